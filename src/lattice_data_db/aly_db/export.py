@@ -1,39 +1,211 @@
 #!/usr/bin/env python3
 
+import os
+import json
 import sqlite3
 import numpy
+import hashlib
+import uuid
 
-from ..db_backend.db_objecthandles import Collection, Measurement, DBValue, Configuration
+from ..db_backend.db_objecthandles import Collection, Measurement, DBValue, Configuration, ConfigurationBatch
+from ..db_backend.array_converter import convert_array
+from ..db_backend.tasks import _find_collection_id
 
-def export_measurement_collection(connection: sqlite3.Connection, measurement_name: str, collection_name: str, locals=None):
+_measurement_collection_query = (
+        "SELECT measurements.configuration, configurations.ensemble, configurations.ensemble_relapath, configurations.load_promise, "\
+        "data_values.is_inline, CAST(data_values.av AS BLOB), data_values.load_promise, data_values.relapath "\
+        "FROM collections_contains "\
+        "INNER JOIN measurements ON measurements.configuration = collections_contains.configuration "\
+        "INNER JOIN configurations ON configurations.rowid = measurements.configuration "\
+        "INNER JOIN data_values ON data_values.rowid = measurements.value "\
+        "WHERE collections_contains.collection = ? AND measurements.name = ? "\
+        "ORDER BY measurements.rowid")
+
+# Measurements and collection members are never updated or deleted, i.e., the count and
+# the maximum rowids change whenever the exported measurements change.
+# Answered from the indices on measurements(name, configuration) and
+# collections_contains(collection, configuration).
+_export_cache_key_query = (
+        "SELECT COUNT(*), MAX(measurements.rowid), MAX(collections_contains.rowid) "\
+        "FROM collections_contains "\
+        "INNER JOIN measurements ON measurements.configuration = collections_contains.configuration "\
+        "WHERE collections_contains.collection = ? AND measurements.name = ?")
+
+# directory in the file storage of the database.
+export_cache_dir = "export_cache"
+
+def _stack_arrays(arrays):
+    """
+    Stack the arrays into one preallocated array of shape ``(len(arrays), *value_shape)``.
+    """
+    if(len(arrays) == 0):
+        return numpy.empty((0,))
+
+    shape = arrays[0].shape
+    for arr in arrays:
+        if(arr.shape != shape):
+            raise ValueError(f"cannot stack values of different shapes: {shape} and {arr.shape}")
+
+    out = numpy.empty((len(arrays),) + shape, dtype=numpy.result_type(*arrays))
+    for i, arr in enumerate(arrays):
+        out[i] = arr
+    return out
+
+class _ValueLoader:
+    """
+    Decodes the value columns of ``_measurement_collection_query``.
+    """
+    def __init__(self, connection: sqlite3.Connection, locals=None):
+        self._connection = connection
+        self._locals = locals
+        self._basepath = None
+
+    def __call__(self, is_inline, av, load_promise, relapath):
+        if(is_inline):
+            # zero-copy view into the blob.
+            return convert_array(av)
+        if(self._basepath is None):
+            self._basepath = DBValue.get_basepth(self._connection)
+        return DBValue._load_file(self._basepath, load_promise, relapath, locals=self._locals)
+
+def _export_cache_path(connection: sqlite3.Connection, collection_id: int, measurement_name: str):
+    """
+    The path of the cached export for the current measurements and the prefix of all cached exports
+    of (collection, name). The configurations are cached next to it in a ``.json`` file.
+    """
+    key = connection.execute(_export_cache_key_query, (collection_id, measurement_name)).fetchone()
+    name_hash = hashlib.sha1(measurement_name.encode("utf-8")).hexdigest()[:16]
+    key_hash = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    prefix = f"{collection_id}-{name_hash}-"
+    directory = DBValue.get_basepth(connection) / export_cache_dir
+    return directory / f"{prefix}{key_hash}.npy", directory, prefix
+
+def _is_readonly(connection: sqlite3.Connection):
+    if(getattr(connection, "readonly", False)):
+        return True
+    return bool(connection.execute("PRAGMA query_only").fetchone()[0])
+
+def _read_export_cache(path):
+    """
+    The cached configuration rows and the memory-mapped values, or None.
+    """
+    rows_path = path.with_suffix(".json")
+    if(not path.exists() or not rows_path.exists()):
+        return None
+    with open(rows_path) as fin:
+        rows = [tuple(row) for row in json.load(fin)]
+    return rows, numpy.load(path, mmap_mode="r")
+
+def _write_export_cache(path, directory, prefix, rows, values):
+    os.makedirs(directory, exist_ok=True)
+    # The rows are written first: the values file marks a complete entry.
+    tmp_path = directory / f".{uuid.uuid4().hex}.json"
+    with open(tmp_path, "w") as fout:
+        json.dump(rows, fout)
+    os.replace(tmp_path, path.with_suffix(".json"))
+    tmp_path = directory / f".{uuid.uuid4().hex}.npy"
+    numpy.save(tmp_path, values)
+    os.replace(tmp_path, path)
+    # Exports of older measurements are not used anymore.
+    for f in os.listdir(directory):
+        if(f.startswith(prefix) and os.path.splitext(f)[0] != path.stem):
+            os.remove(directory / f)
+
+def export_measurement_collection(connection: sqlite3.Connection, measurement_name: str, collection_name: str, locals=None, cache=False, output="objects"):
     """
     Export a collection of measurements from the database.
     If the measurements are returned either as a list of values, if they are stored on-file 
     or as a numpy array, if they are stored in-line.
 
+    Configurations, measurements and in-line values are fetched using a single query;
+    in-line values are decoded directly into the stacked array of shape ``(n_conf, *value_shape)``.
+
+    See ``iter_measurement_collection`` for a streaming version.
+
+    If ``cache`` is True, stacked arrays are cached in ``.npy`` files in the file storage of the
+    database (``export_cache/``) together with the configurations. The cache is keyed by the number
+    of measurements and the maximum rowids of the measurements and the collection members, i.e.,
+    new measurements or collection members invalidate it. A cache hit costs one aggregate query.
+    Cached arrays are memory-mapped read-only. ``locals`` are not part of the key.
+    Read-only connections (``mode="ro"`` or ``PRAGMA query_only``) use the cache, but do not write it.
 
+    With ``output="batch"`` the configurations are returned as one ``ConfigurationBatch`` 
+    instead of a list of ``Configuration`` objects.
     """
+    if(output not in ("objects", "batch")):
+        raise ValueError(f"unknown output: {output}")
+    def make_configurations(rows):
+        if(output == "batch"):
+            return ConfigurationBatch.from_rows(rows)
+        return [Configuration(ensemble, ensemble_relapath, conf_load_promise, id=cid) for cid, ensemble, ensemble_relapath, conf_load_promise in rows]
 
-    collection = Collection.findby_name(connection, collection_name)
-    if(isinstance(collection, list)):
-        raise ValueError(f"Collection name clash detected: {collection_name}")
-    cursor = connection.cursor()
-    c = cursor.execute(
-            "SELECT measurements.rowid "\
-            "FROM measurements INNER JOIN collections_contains "\
-            "ON measurements.configuration = collections_contains.configuration "\
-            "WHERE collections_contains.collection = ? AND measurements.name=?"
-            , (collection._id, measurement_name))
+    collection_id = _find_collection_id(connection, collection_name)
+    if(cache):
+        path, directory, prefix = _export_cache_path(connection, collection_id, measurement_name)
+        cached = _read_export_cache(path)
+        if(cached is not None):
+            rows, values = cached
+            return make_configurations(rows), values
 
-    measurements = [Measurement.load(connection, v[0], locals=locals) for v in c]
+    cursor = connection.cursor()
+    c = cursor.execute(_measurement_collection_query, (collection_id, measurement_name))
+    load_value = _ValueLoader(connection, locals=locals)
 
-    configurations = [Configuration.load(connection, m._configuration) for m in measurements]
-    values = [m._value._value for m in measurements]
+    rows = []
+    values = []
+    all_inline = True
+    for cid, ensemble, ensemble_relapath, conf_load_promise, is_inline, av, load_promise, relapath in c.fetchall():
+        rows.append((cid, ensemble, ensemble_relapath, conf_load_promise))
+        all_inline = all_inline and is_inline
+        values.append(load_value(is_inline, av, load_promise, relapath))
+    configurations = make_configurations(rows)
 
-    # see if the values are numpy arrays:
-    if(measurements[0]._value._is_external):
+    if(not all_inline):
         return configurations, values
-    return configurations, numpy.array(values)
+    values = _stack_arrays(values)
+    if(cache and len(configurations) > 0 and not _is_readonly(connection)):
+        _write_export_cache(path, directory, prefix, rows, values)
+    return configurations, values
+
+def iter_measurement_collection(connection: sqlite3.Connection, measurement_name: str, collection_name: str, batch_size=None, locals=None, fetch_size=256):
+    """
+    Stream a collection of measurements from the database. Only ``fetch_size`` rows 
+    (or ``batch_size`` rows) are fetched from the cursor at once and values are loaded 
+    only when they are consumed, such that the memory usage is bounded.
+
+    If ``batch_size`` is None, ``(configuration_id, value)`` pairs are yielded.
+    Otherwise, ``(configuration_ids, values)`` batches of at most ``batch_size`` measurements
+    are yielded; ``values`` is stacked into an array of shape ``(len(configuration_ids), *value_shape)``
+    if all values are numpy arrays and a list otherwise.
+
+    The order is the same as in ``export_measurement_collection``.
+    """
+    if(batch_size is not None and batch_size < 1):
+        raise ValueError("batch_size must be positive")
+
+    collection_id = _find_collection_id(connection, collection_name)
+    cursor = connection.cursor()
+    c = cursor.execute(_measurement_collection_query, (collection_id, measurement_name))
+    load_value = _ValueLoader(connection, locals=locals)
+
+    try:
+        while(True):
+            rows = c.fetchmany(fetch_size if batch_size is None else batch_size)
+            if(len(rows) == 0):
+                return
+
+            if(batch_size is None):
+                for row in rows:
+                    yield row[0], load_value(*row[4:])
+                continue
+
+            ids = [row[0] for row in rows]
+            values = [load_value(*row[4:]) for row in rows]
+            if(all(isinstance(v, numpy.ndarray) for v in values)):
+                values = _stack_arrays(values)
+            yield ids, values
+    finally:
+        c.close()
 
 def list_measurements(connection: sqlite3.Connection):
     """
@@ -1,15 +1,82 @@
 #!/usr/bin/env python3
 
+import os
 import numpy
 
-from ..htp_db.datastore import HTPStore
+from ..htp_db.datastore import HTPStore, DataLoadError
 
-def export_measurement_group(store: HTPStore, group: str, locals=None):
+def _allocate_output(out, shape, dtype):
+    if(out is None):
+        return numpy.empty(shape, dtype=dtype)
+    if(isinstance(out, (str, os.PathLike))):
+        return numpy.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=shape)
+    if(out.shape != shape):
+        raise ValueError(f"output array has shape {out.shape}, expected {shape}")
+    return out
+
+def _lossy(value_dtype, out_dtype):
+    return not numpy.can_cast(value_dtype, out_dtype, casting="safe")
+
+def export_measurement_group(store: HTPStore, group: str, locals=None, out=None, workers=1, executor="thread"):
+    """
+    Export the data of all tags in ``group`` as one array of shape ``(n_tags, *data_shape)``.
+
+    The data is written directly into the output array which is either newly allocated (``out=None``),
+    a memory-mapped ``.npy`` file that is created at the path ``out``, or the array ``out``.
+    Together with a store opened with ``mmap_mode="r"`` this allows to export groups that
+    are larger than the memory.
+
+    The dtype of the newly allocated array is the common dtype of all data (e.g., complex if
+    some data is complex); data that cannot be stored in the dtype of ``out`` without loss
+    fails with a ``TypeError``.
+
+    Files are loaded concurrently by ``workers`` threads or processes, see ``HTPStore.iter_data_many``.
+    If some files fail to load, the remaining files are loaded nevertheless and
+    a ``DataLoadError`` listing all failures is raised.
+    """
     store.sync_journal()
 
     tags = store.groups[group]
-    data = np.array([store.get_data(tag, locals=locals) for tag in tags])
     all_meta = store.meta
     meta = [all_meta[tag] for tag in tags]
-    return tags, data, meta
+    if(len(tags) == 0):
+        return tags, _allocate_output(out, (0,), numpy.float64), meta
 
+    # The first file that loads determines shape and dtype of the output.
+    failures = {}
+    first = None
+    for start, tag in enumerate(tags):
+        try:
+            first = numpy.asarray(store.get_data(tag, locals=locals))
+            break
+        except Exception as e:
+            failures[tag] = e
+    if(first is None):
+        raise DataLoadError(failures)
+
+    data = _allocate_output(out, (len(tags),) + first.shape, first.dtype)
+    if(_lossy(first.dtype, data.dtype)):
+        failures[tags[start]] = TypeError(f"data of {tags[start]} has dtype {first.dtype}, output array has dtype {data.dtype}")
+    else:
+        data[start] = first
+    del first
+
+    start += 1
+    for index, tag, value, error in store.iter_data_many(tags[start:], workers=workers, executor=executor, locals=locals):
+        if(error is None and numpy.shape(value) != data.shape[1:]):
+            error = ValueError(f"data of {tag} has shape {numpy.shape(value)}, expected {data.shape[1:]}")
+        if(error is None and _lossy(numpy.asarray(value).dtype, data.dtype)):
+            if(out is None):
+                # e.g., complex data after real data.
+                data = data.astype(numpy.result_type(data.dtype, numpy.asarray(value).dtype))
+            else:
+                error = TypeError(f"data of {tag} has dtype {numpy.asarray(value).dtype}, output array has dtype {data.dtype}")
+        if(error is not None):
+            failures[tag] = error
+            continue
+        data[start + index] = value
+
+    if(len(failures) > 0):
+        raise DataLoadError(failures)
+
+    return tags, data, meta
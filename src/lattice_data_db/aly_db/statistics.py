@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Means and jackknife samples of measurements on collections.
+
+The results are stored in the ``means`` and ``jackknifes`` tables together
+with a fingerprint of the measurements they were computed from and their
+running sum (``statistics_state``). As long as the measurements do not change,
+the stored results are used. If measurements were only added, the results are
+updated incrementally. Stored values are never modified (other connections may
+have cached them): an update inserts new values and points the tables to them.
+
+Blocked jackknife and bootstrap samples are stored as one stacked value per
+(collection, name, method, parameter, seed) in ``resamples``. They are computed
+from the values in configuration order (the order of the Markov chain),
+independent of the order the measurements were written in. The bootstrap
+index matrices are stored once per (collection, seed, number of samples,
+configurations) in ``resample_indices`` and shared by all measurements.
+"""
+
+import sqlite3
+import hashlib
+import numpy
+
+from ..db_backend.db_objecthandles import DBValue, _transaction, _insert_many
+from ..db_backend.array_converter import convert_array
+from ..db_backend.context import DBContext
+from ..db_backend.tasks import _find_collection_id
+from .export import export_measurement_collection, _stack_arrays, _ValueLoader
+
+_fingerprint_query = (
+        "SELECT COUNT(*), MAX(measurements.rowid), TOTAL(measurements.rowid + measurements.value) "\
+        "FROM collections_contains "\
+        "INNER JOIN measurements ON measurements.configuration = collections_contains.configuration "\
+        "WHERE collections_contains.collection = ? AND measurements.name = ?")
+
+_new_measurements_query = (
+        "SELECT measurements.configuration, "\
+        "data_values.is_inline, CAST(data_values.av AS BLOB), data_values.load_promise, data_values.relapath "\
+        "FROM collections_contains "\
+        "INNER JOIN measurements ON measurements.configuration = collections_contains.configuration "\
+        "INNER JOIN data_values ON data_values.rowid = measurements.value "\
+        "WHERE collections_contains.collection = ? AND measurements.name = ? AND measurements.rowid > ? "\
+        "ORDER BY measurements.rowid")
+
+_jackknifes_query = (
+        "SELECT jackknifes.configuration, jackknifes.rowid, jackknifes.value, CAST(data_values.av AS BLOB) "\
+        "FROM jackknifes "\
+        "INNER JOIN data_values ON data_values.rowid = jackknifes.value "\
+        "WHERE jackknifes.collection = ? AND jackknifes.name = ? "\
+        "ORDER BY jackknifes.rowid")
+
+def jackknife_samples(values: numpy.ndarray):
+    """
+    The leave-one-out jackknife samples of ``values`` (shape ``(N, *value_shape)``):
+    ``samples[i]`` is the mean of all values but ``values[i]``.
+    Uses the total sum, i.e., O(N) operations.
+    """
+    n = values.shape[0]
+    if(n < 2):
+        raise ValueError("jackknife requires at least two values")
+    total = values.sum(axis=0)
+    return (total - values) / (n - 1)
+
+def blocked_jackknife_samples(values: numpy.ndarray, bin_size: int):
+    """
+    The jackknife samples of ``values`` leaving out one block of ``bin_size`` consecutive values.
+    If ``bin_size`` does not divide ``N``, the last ``N % bin_size`` values are dropped.
+    """
+    if(bin_size < 1):
+        raise ValueError("bin_size must be positive")
+    n_bins = values.shape[0] // bin_size
+    if(n_bins < 2):
+        raise ValueError("blocked jackknife requires at least two blocks")
+    n = n_bins * bin_size
+    blocks = values[:n].reshape((n_bins, bin_size) + values.shape[1:]).sum(axis=1)
+    return (blocks.sum(axis=0) - blocks) / (n - bin_size)
+
+def bootstrap_indices(n_conf: int, n_samples: int, seed: int):
+    """
+    The index matrix of shape ``(n_samples, n_conf)`` of ``n_samples`` bootstrap resamples,
+    drawn from ``numpy.random.default_rng(seed)``.
+    """
+    dtype = numpy.int32 if n_conf < 2**31 else numpy.int64
+    return numpy.random.default_rng(seed).integers(0, n_conf, size=(n_samples, n_conf), dtype=dtype)
+
+def bootstrap_samples(values: numpy.ndarray, indices: numpy.ndarray):
+    """
+    The bootstrap samples (means of the resamples) of ``values`` for the index matrix ``indices``.
+    """
+    if(indices.shape[1] != values.shape[0]):
+        raise ValueError(f"index matrix is for {indices.shape[1]} values, got {values.shape[0]}")
+    return values[indices].mean(axis=1)
+
+def _export_values(connection: sqlite3.Connection, measurement_name: str, collection_name: str, locals=None):
+    configurations, values = export_measurement_collection(connection, measurement_name, collection_name, locals=locals, output="batch")
+    if(isinstance(values, list)):
+        values = _stack_arrays([numpy.asarray(v) for v in values])
+    return configurations.ids.tolist(), values
+
+def _fingerprint(connection: sqlite3.Connection, collection_id: int, measurement_name: str, max_measurement=None):
+    """
+    ``(n, max_measurement, checksum)`` of the measurements, optionally only of those with ``rowid <= max_measurement``.
+    """
+    query, args = _fingerprint_query, (collection_id, measurement_name)
+    if(max_measurement is not None):
+        query, args = query + " AND measurements.rowid <= ?", args + (max_measurement,)
+    n, max_measurement, checksum = connection.execute(query, args).fetchone()
+    return n, max_measurement, int(checksum)
+
+def _read_statistics(connection: sqlite3.Connection, collection_id: int, measurement_name: str):
+    """
+    Returns ``(configuration_ids, mean, jackknife)``, the data_values id of the mean and
+    ``(jackknifes rowid, data_values id)`` of the jackknife samples.
+    """
+    c = connection.execute("SELECT means.value, CAST(data_values.av AS BLOB) FROM means "\
+                           "INNER JOIN data_values ON data_values.rowid = means.value "\
+                           "WHERE means.collection = ? AND means.name = ?", (collection_id, measurement_name))
+    mean_id, mean = c.fetchone()
+
+    rows = connection.execute(_jackknifes_query, (collection_id, measurement_name)).fetchall()
+    configuration_ids = [row[0] for row in rows]
+    jackknife_ids = [(row[1], row[2]) for row in rows]
+    jackknife = _stack_arrays([convert_array(row[3]) for row in rows])
+    return (configuration_ids, convert_array(mean), jackknife), mean_id, jackknife_ids
+
+def _invalidate(connection: sqlite3.Connection, rids):
+    # The values are deleted.
+    DBContext.of(connection).invalidate("data_values", rids)
+
+def _delete_statistics(connection: sqlite3.Connection, collection_id: int, measurement_name: str):
+    """
+    Delete the means and jackknifes of (collection, name) and their values. Must be called inside a transaction.
+    """
+    for table, column in (("statistics_state", "sum"), ("means", "value"), ("jackknifes", "value")):
+        subquery = f"SELECT {column} FROM {table} WHERE collection = ? AND name = ?"
+        _invalidate(connection, [f[0] for f in connection.execute(subquery, (collection_id, measurement_name))])
+        connection.execute(f"DELETE FROM data_values WHERE rowid IN ({subquery})", (collection_id, measurement_name))
+        if(table != "statistics_state"):
+            connection.execute(f"DELETE FROM {table} WHERE collection = ? AND name = ?", (collection_id, measurement_name))
+
+def _insert_jackknifes(connection: sqlite3.Connection, collection_id: int, measurement_name: str, configuration_ids, jackknife, chunk_size=1000):
+    for i in range(0, len(configuration_ids), chunk_size):
+        values = [DBValue(sample) for sample in jackknife[i:i + chunk_size]]
+        DBValue._insert_many(connection, values)
+        _insert_many(connection, "INSERT INTO jackknifes VALUES(?, ?, ?, ?)"
+                     , [(collection_id, cid, measurement_name, v._id) for cid, v in zip(configuration_ids[i:i + chunk_size], values)])
+
+def _store_statistics(connection: sqlite3.Connection, collection_id: int, measurement_name: str, fingerprint, configuration_ids, total, mean, jackknife):
+    """
+    Replace the stored statistics of (collection, name) in one transaction.
+    """
+    with _transaction(connection):
+        _delete_statistics(connection, collection_id, measurement_name)
+
+        mean_value, total_value = DBValue(mean), DBValue(total)
+        DBValue._insert_many(connection, [mean_value, total_value])
+        connection.execute("INSERT INTO means VALUES(?, ?, ?)", (collection_id, measurement_name, mean_value._id))
+        _insert_jackknifes(connection, collection_id, measurement_name, configuration_ids, jackknife)
+
+        connection.execute("INSERT OR REPLACE INTO statistics_state(collection, name, n, max_measurement, checksum, sum) VALUES(?, ?, ?, ?, ?, ?)"
+                           , (collection_id, measurement_name, *fingerprint, total_value._id))
+
+def _update_statistics(connection: sqlite3.Connection, collection_id: int, measurement_name: str, fingerprint, state, locals=None):
+    """
+    Add the measurements with ``rowid > max_measurement`` to the stored statistics.
+    The jackknife samples are updated using the running sum ``S``:
+    ``J_new = ((N_old - 1) J_old + S_new - S_old) / (N_new - 1)``.
+    Returns None if the new measurements do not match ``fingerprint``.
+    """
+    n_old, max_measurement, _, total_id = state
+    load_value = _ValueLoader(connection, locals=locals)
+    rows = connection.execute(_new_measurements_query, (collection_id, measurement_name, max_measurement)).fetchall()
+    if(len(rows) != fingerprint[0] - n_old):
+        return None
+    new_ids = [row[0] for row in rows]
+    new_values = _stack_arrays([numpy.asarray(load_value(*row[1:])) for row in rows])
+
+    (configuration_ids, _, jackknife), mean_id, jackknife_ids = _read_statistics(connection, collection_id, measurement_name)
+    # Not through the value cache.
+    total_old = convert_array(connection.execute("SELECT CAST(av AS BLOB) FROM data_values WHERE rowid = ?", (total_id,)).fetchone()[0])
+    if(new_values.shape[1:] != total_old.shape):
+        return None
+
+    n_new = fingerprint[0]
+    total = total_old + new_values.sum(axis=0)
+    jackknife = ((n_old - 1) * jackknife + (total - total_old)) / (n_new - 1)
+    new_jackknife = (total - new_values) / (n_new - 1)
+    mean = total / n_new
+
+    old_ids = [rid for _, rid in jackknife_ids] + [mean_id, total_id]
+    with _transaction(connection):
+        samples = [DBValue(sample) for sample in jackknife]
+        mean_value, total_value = DBValue(mean), DBValue(total)
+        DBValue._insert_many(connection, samples + [mean_value, total_value])
+        connection.executemany("UPDATE jackknifes SET value = ? WHERE rowid = ?"
+                               , [(sample._id, rowid) for sample, (rowid, _) in zip(samples, jackknife_ids)])
+        connection.execute("UPDATE means SET value = ? WHERE rowid IN (SELECT rowid FROM means WHERE collection = ? AND name = ?)"
+                           , (mean_value._id, collection_id, measurement_name))
+        _insert_jackknifes(connection, collection_id, measurement_name, new_ids, new_jackknife)
+        connection.execute("UPDATE statistics_state SET n = ?, max_measurement = ?, checksum = ?, sum = ? WHERE collection = ? AND name = ?"
+                           , (*fingerprint, total_value._id, collection_id, measurement_name))
+        connection.executemany("DELETE FROM data_values WHERE rowid = ?", [(rid,) for rid in old_ids])
+    _invalidate(connection, old_ids)
+
+    return configuration_ids + new_ids, mean, numpy.concatenate([jackknife, new_jackknife])
+
+def compute_statistics(connection: sqlite3.Connection, measurement_name: str, collection_name: str, recompute=False, locals=None):
+    """
+    Computes the mean and the leave-one-out jackknife samples of ``measurement_name`` on the collection.
+    Returns ``(configuration_ids, mean, jackknife)`` where ``jackknife[i]`` is the jackknife sample
+    leaving out ``configuration_ids[i]``.
+
+    The results are stored in the ``means`` and ``jackknifes`` tables. If the measurements
+    did not change since, the stored results are returned, unless ``recompute`` is True.
+    If measurements were only added (e.g., after ``Collection.add_configurations``),
+    the stored results are updated in O(number of configurations) operations.
+
+    ``locals`` are passed to ``export_measurement_collection``.
+    """
+    collection_id = _find_collection_id(connection, collection_name)
+    fingerprint = _fingerprint(connection, collection_id, measurement_name)
+
+    state = connection.execute("SELECT n, max_measurement, checksum, sum FROM statistics_state WHERE collection = ? AND name = ?"
+                               , (collection_id, measurement_name)).fetchone()
+    if(not recompute and state is not None and state[3] is not None):
+        if(state[:3] == fingerprint):
+            return _read_statistics(connection, collection_id, measurement_name)[0]
+        # Only new measurements?
+        if(_fingerprint(connection, collection_id, measurement_name, max_measurement=state[1]) == state[:3]):
+            result = _update_statistics(connection, collection_id, measurement_name, fingerprint, state, locals=locals)
+            if(result is not None):
+                return result
+
+    configuration_ids, values = _export_values(connection, measurement_name, collection_name, locals=locals)
+
+    total = values.sum(axis=0)
+    mean = total / len(configuration_ids)
+    jackknife = jackknife_samples(values)
+
+    _store_statistics(connection, collection_id, measurement_name, fingerprint, configuration_ids, total, mean, jackknife)
+    return configuration_ids, mean, jackknife
+
+_configuration_ids_query = (
+        "SELECT measurements.configuration "\
+        "FROM collections_contains "\
+        "INNER JOIN measurements ON measurements.configuration = collections_contains.configuration "\
+        "WHERE collections_contains.collection = ? AND measurements.name = ? "\
+        "ORDER BY measurements.configuration, measurements.rowid")
+
+def _configurations_checksum(configuration_ids):
+    """
+    A 64 bit checksum of the (ordered) configuration ids.
+    """
+    digest = hashlib.blake2b(numpy.asarray(configuration_ids, dtype="<i8").tobytes(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+def _resample_indices(connection: sqlite3.Connection, collection_id: int, configuration_ids, n_samples: int, seed: int):
+    """
+    Loads the bootstrap index matrix for ``configuration_ids`` (in this order) or generates and stores it.
+    """
+    n_conf = len(configuration_ids)
+    checksum = _configurations_checksum(configuration_ids)
+    row = connection.execute("SELECT CAST(data_values.av AS BLOB) FROM resample_indices "\
+                             "INNER JOIN data_values ON data_values.rowid = resample_indices.value "\
+                             "WHERE resample_indices.collection = ? AND resample_indices.seed = ? AND resample_indices.n_samples = ? "\
+                             "AND resample_indices.n_conf = ? AND resample_indices.configurations = ?"
+                             , (collection_id, seed, n_samples, n_conf, checksum)).fetchone()
+    if(row is not None):
+        return convert_array(row[0])
+
+    indices = bootstrap_indices(n_conf, n_samples, seed)
+    with _transaction(connection):
+        rid = DBValue(indices)._insert(connection)
+        connection.execute("INSERT INTO resample_indices VALUES(?, ?, ?, ?, ?, ?)", (collection_id, seed, n_samples, n_conf, rid, checksum))
+    return indices
+
+def _compute_resamples(connection: sqlite3.Connection, measurement_name: str, collection_name: str, method: str, parameter: int, seed, resample, recompute, locals):
+    """
+    Loads the stored samples of ``method`` or computes them using ``resample(collection_id, configuration_ids, values)``
+    and stores them, replacing older samples. The values are passed in configuration order.
+    """
+    collection_id = _find_collection_id(connection, collection_name)
+    fingerprint = _fingerprint(connection, collection_id, measurement_name)
+    key = (collection_id, measurement_name, method, parameter, seed)
+
+    # "IS ?" matches the NULL seed of the jackknife.
+    where = "resamples.collection = ? AND resamples.name = ? AND resamples.method = ? AND resamples.parameter = ? AND resamples.seed IS ?"
+    row = connection.execute("SELECT resamples.n, resamples.max_measurement, resamples.checksum, CAST(data_values.av AS BLOB) FROM resamples "\
+                             f"INNER JOIN data_values ON data_values.rowid = resamples.value WHERE {where}", key).fetchone()
+    if(not recompute and row is not None and tuple(row[:3]) == fingerprint):
+        configuration_ids = [f[0] for f in connection.execute(_configuration_ids_query, (collection_id, measurement_name))]
+        return configuration_ids, convert_array(row[3])
+
+    configuration_ids, values = _export_values(connection, measurement_name, collection_name, locals=locals)
+    # The export is in measurement order, which depends on the order the measurements were written in.
+    order = numpy.argsort(configuration_ids, kind="stable")
+    configuration_ids = [configuration_ids[i] for i in order]
+    samples = resample(collection_id, configuration_ids, values[order])
+
+    with _transaction(connection):
+        _invalidate(connection, [f[0] for f in connection.execute(f"SELECT value FROM resamples WHERE {where}", key)])
+        connection.execute(f"DELETE FROM data_values WHERE rowid IN (SELECT value FROM resamples WHERE {where})", key)
+        connection.execute(f"DELETE FROM resamples WHERE {where}", key)
+        rid = DBValue(samples)._insert(connection)
+        connection.execute("INSERT INTO resamples VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)", key + fingerprint + (rid,))
+    return configuration_ids, samples
+
+def compute_blocked_jackknife(connection: sqlite3.Connection, measurement_name: str, collection_name: str, bin_size: int, recompute=False, locals=None):
+    """
+    Computes the blocked jackknife samples (see ``blocked_jackknife_samples``) of ``measurement_name``
+    on the collection. The blocks are consecutive configurations in configuration order.
+    Returns ``(configuration_ids, samples)``, the configuration ids in configuration order.
+    The samples are stored and reused as long as the measurements do not change.
+    """
+    return _compute_resamples(connection, measurement_name, collection_name, "blocked_jackknife", bin_size, None
+                              , lambda collection_id, configuration_ids, values: blocked_jackknife_samples(values, bin_size)
+                              , recompute, locals)
+
+def compute_bootstrap(connection: sqlite3.Connection, measurement_name: str, collection_name: str, n_samples: int, seed: int, recompute=False, locals=None):
+    """
+    Computes ``n_samples`` bootstrap samples of ``measurement_name`` on the collection. 
+    Returns ``(configuration_ids, samples)``, the configuration ids in configuration order.
+
+    The index matrix is generated once per (collection, seed, n_samples, configurations)
+    and used for all measurements on the same configurations, such that the samples of different
+    measurements are correlated as required for derived quantities. The samples are stored and
+    reused as long as the measurements do not change.
+    """
+    def resample(collection_id, configuration_ids, values):
+        indices = _resample_indices(connection, collection_id, configuration_ids, n_samples, seed)
+        return bootstrap_samples(values, indices)
+
+    return _compute_resamples(connection, measurement_name, collection_name, "bootstrap", n_samples, seed
+                              , resample, recompute, locals)
@@ -2,23 +2,112 @@
 
 """
 Store and load numpy arrays in SQLite3.
+
+Arrays are stored in a compact binary format: a small header containing
+a magic, the format version, the dtype and the shape, padded to a multiple
+of ``ARRAY_CODEC_ALIGNMENT`` bytes, followed by the raw (C-ordered) array
+buffer. Decoding uses ``numpy.frombuffer`` over the blob returned by SQLite,
+i.e., it does not copy the data. As a consequence arrays loaded from the
+database are read-only. The padding keeps the data aligned (like in ``.npy``
+files), as the buffers of Python ``bytes`` objects are 16 byte aligned.
+
+Arrays that cannot be represented this way (structured dtypes) are stored
+as plain ``.npy`` blobs. Blobs written by older versions (base64 encoded
+``.npy`` files and version 1 of the compact format, which has no padding)
+can still be read; use ``migrate_array_storage`` to rewrite them in the
+current compact format.
 """
 
 import sqlite3
 import numpy
 import io
 import base64
+import struct
+
+ARRAY_CODEC_MAGIC = b"LDDA"
+ARRAY_CODEC_VERSION = 2
+ARRAY_CODEC_ALIGNMENT = 16
+
+# magic, version, ndim, length of the dtype string
+_header = struct.Struct("<4sBBH")
+_npy_magic = b"\x93NUMPY"
+
+def is_compact_array(blob):
+    return bytes(blob[:len(ARRAY_CODEC_MAGIC)]) == ARRAY_CODEC_MAGIC
 
 def adapt_array(arr):
-    out = io.BytesIO()
-    numpy.save(out, arr, allow_pickle=False)
-    out.seek(0, 0)
-    return sqlite3.Binary(base64.b64encode(out.read()))
+    if(arr.dtype.fields is not None or arr.dtype.hasobject):
+        out = io.BytesIO()
+        numpy.save(out, arr, allow_pickle=False)
+        return sqlite3.Binary(out.getvalue())
+
+    if(not arr.flags.c_contiguous):
+        arr = arr.copy(order="C")
+    dtype = arr.dtype.str.encode("ascii")
+    header = _header.pack(ARRAY_CODEC_MAGIC, ARRAY_CODEC_VERSION, arr.ndim, len(dtype))
+    shape = struct.pack(f"<{arr.ndim}Q", *arr.shape)
+    padding = b"\0" * (-(len(header) + len(dtype) + len(shape)) % ARRAY_CODEC_ALIGNMENT)
+
+    return sqlite3.Binary(b"".join([header, dtype, shape, padding, arr.reshape(-1).view(numpy.uint8)]))
+
+def decode_compact_array(blob):
+    """
+    Decode an array stored in the compact format without copying the data.
+    """
+    magic, version, ndim, dtype_len = _header.unpack_from(blob, 0)
+    if(version > ARRAY_CODEC_VERSION):
+        raise ValueError(f"array codec version {version} is not supported (supported: <= {ARRAY_CODEC_VERSION})")
+
+    offset = _header.size
+    dtype = numpy.dtype(bytes(blob[offset:offset + dtype_len]).decode("ascii"))
+    offset += dtype_len
+    shape = struct.unpack_from(f"<{ndim}Q", blob, offset)
+    offset += 8 * ndim
+    if(version >= 2):
+        offset += -offset % ARRAY_CODEC_ALIGNMENT
+
+    count = 1
+    for s in shape:
+        count *= s
+    return numpy.frombuffer(blob, dtype=dtype, count=count, offset=offset).reshape(shape)
 
 def convert_array(text):
+    if(is_compact_array(text)):
+        return decode_compact_array(text)
+    if(text[:len(_npy_magic)] == _npy_magic):
+        return numpy.load(io.BytesIO(text), allow_pickle=False)
+
+    # legacy format: base64 encoded .npy file.
     fin = io.BytesIO(base64.b64decode(text))
     return numpy.load(fin)
 
+def migrate_array_storage(connection: sqlite3.Connection, chunk_size=1000):
+    """
+    Rewrite all inline arrays in ``data_values.av`` that are stored in the legacy
+    base64 format or in an older version of the compact format using the current
+    compact format. Returns the number of rewritten values.
+    Automatically commits these changes.
+    """
+    cursor = connection.cursor()
+    n_migrated = 0
+    last_rid = -1
+    while True:
+        # CAST bypasses the ``array`` converter such that we see the raw blob.
+        c = cursor.execute("SELECT rowid, CAST(av AS BLOB) FROM data_values WHERE is_inline=1 AND rowid>? ORDER BY rowid LIMIT ?", (last_rid, chunk_size))
+        rows = c.fetchall()
+        if(len(rows) == 0):
+            break
+        last_rid = rows[-1][0]
+
+        updates = [(adapt_array(convert_array(blob)), rid) for rid, blob in rows
+                   if not (blob is None or blob[:len(_npy_magic)] == _npy_magic
+                           or (is_compact_array(blob) and blob[len(ARRAY_CODEC_MAGIC)] == ARRAY_CODEC_VERSION))]
+        cursor.executemany("UPDATE data_values SET av=? WHERE rowid=?", updates)
+        n_migrated += len(updates)
+
+    connection.commit()
+    return n_migrated
+
 sqlite3.register_adapter(numpy.ndarray, adapt_array)
 sqlite3.register_converter("array", convert_array)
 
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Open database connections.
+
+``open_database`` returns connections (``DBConnection``) that have the array
+converters enabled, hold their ``DBContext`` and are tuned for many analysis
+processes sharing one database file: The database uses write-ahead logging such that readers do not block the
+writer (and vice versa) and waits for locks instead of failing with
+``database is locked``.
+"""
+
+import os
+import sqlite3
+import pathlib
+import threading
+
+from .array_converter import sentinel
+from .context import DBContext, DBConnection
+
+modes = ("ro", "rw", "rwc")
+pools = (None, "thread", "process")
+
+# Applied in this order to every connection. journal_mode is only set for writable connections.
+default_pragmas = {
+        "busy_timeout": 30000
+        , "journal_mode": "WAL"
+        # Safe with WAL: a power loss may lose the last transactions, but does not corrupt the database.
+        , "synchronous": "NORMAL"
+        # negative: KiB, i.e., 64 MiB.
+        , "cache_size": -65536
+        , "mmap_size": 2**28
+        , "temp_store": "MEMORY"
+        }
+
+_process_pool = {}
+_process_pool_lock = threading.Lock()
+_thread_pool = threading.local()
+
+
+def _connect(path, mode, pragmas):
+    path = str(path)
+    if(path == ":memory:"):
+        connection = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, factory=DBConnection)
+    else:
+        uri = pathlib.Path(path).absolute().as_uri() + f"?mode={mode}"
+        connection = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, factory=DBConnection)
+    connection.readonly = mode == "ro"
+
+    for pragma, value in pragmas.items():
+        if(pragma == "journal_mode" and mode == "ro"):
+            continue
+        # PRAGMA does not support parameters.
+        connection.execute(f"PRAGMA {pragma} = {value}").fetchall()
+    return connection
+
+def open_database(path, mode="rwc", pool=None, pragmas=None):
+    """
+    Open the SQLite3 database at ``path``.
+
+    ``mode`` is one of
+    - ``"rwc"``: read and write, the database is created if it does not exist.
+    - ``"rw"``: read and write.
+    - ``"ro"``: read-only (opened using a ``file:...?mode=ro`` URI). Use these connections for analysis.
+
+    ``pool`` selects connection pooling:
+    - ``None``: a new connection is returned.
+    - ``"thread"``: every thread gets its own connection for ``(path, mode)``.
+    - ``"process"``: all threads of a process share one connection for ``(path, mode)``.
+      Only for ``mode="ro"``: transactions (and ``LAST_INSERT_ROWID()``) of the threads would
+      interleave on a shared connection.
+    A forked child process gets new connections.
+    Pooled connections must not be closed directly; use ``close_pooled``.
+
+    ``pragmas`` update ``default_pragmas``.
+    """
+    if(mode not in modes):
+        raise ValueError(f"unknown mode: {mode}")
+    if(pool not in pools):
+        raise ValueError(f"unknown pool: {pool}")
+    if(pool == "process" and mode != "ro"):
+        raise ValueError(f"pool \"process\" requires mode \"ro\", got mode {mode}; use pool \"thread\" for writing")
+
+    all_pragmas = dict(default_pragmas)
+    if(pragmas is not None):
+        all_pragmas.update(pragmas)
+
+    if(pool is None):
+        return _connect(path, mode, all_pragmas)
+
+    # The pid: thread locals survive fork.
+    key = (os.getpid(), os.path.abspath(path) if str(path) != ":memory:" else ":memory:", mode, tuple(all_pragmas.items()))
+    if(pool == "thread"):
+        if(not hasattr(_thread_pool, "connections")):
+            _thread_pool.connections = {}
+        connections = _thread_pool.connections
+        if(key not in connections):
+            connections[key] = _connect(path, mode, all_pragmas)
+        return connections[key]
+
+    with _process_pool_lock:
+        if(key not in _process_pool):
+            _process_pool[key] = _connect(path, mode, all_pragmas)
+        return _process_pool[key]
+
+def close_pooled():
+    """
+    Close the pooled connections of the current thread and process.
+    Connections inherited from the parent process are kept open.
+    """
+    pid = os.getpid()
+    thread_connections = getattr(_thread_pool, "connections", {})
+    connections = [connection for key, connection in thread_connections.items() if key[0] == pid]
+    _thread_pool.connections = {key: connection for key, connection in thread_connections.items() if key[0] != pid}
+
+    with _process_pool_lock:
+        for key in [key for key in _process_pool if key[0] == pid]:
+            connections.append(_process_pool.pop(key))
+
+    for connection in connections:
+        DBContext.forget(connection)
+        connection.close()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Connection scoped database context.
+
+Caches information about the database that does not change while the
+connection is open, such as the base path of the file storage, and,
+optionally, loaded values (``ValueCache``).
+
+Stored values are immutable: they are inserted and deleted, but never modified.
+Deleted rowids may be reused, though. Therefore the value cache is cleared whenever
+another connection committed changes (``PRAGMA data_version``); changes made on the
+connection itself must be reported using ``DBContext.invalidate``.
+"""
+
+import sqlite3
+import pathlib
+import threading
+import collections
+import weakref
+
+
+class ValueCache:
+    """
+    LRU cache of loaded values keyed by ``(table, rowid)``, bounded by the total
+    ``nbytes`` of the cached arrays. Only numpy arrays are cached; they are made
+    read-only, such that cached entries cannot be modified.
+
+    ``hits``, ``misses`` and ``evictions`` count the cache accesses.
+    """
+    def __init__(self, max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, table: str, rowid: int):
+        """
+        Returns the cached entry or None.
+        """
+        key = (table, rowid)
+        with self._lock:
+            entry = self._entries.get(key)
+            if(entry is None):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, table: str, rowid: int, entry, nbytes: int):
+        """
+        Cache ``entry`` that uses ``nbytes`` bytes. Entries larger than ``max_bytes`` are not cached.
+        """
+        if(nbytes > self.max_bytes):
+            return
+        key = (table, rowid)
+        with self._lock:
+            if(key in self._entries):
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (entry, nbytes)
+            self.nbytes += nbytes
+            while(self.nbytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, table: str, rowids):
+        with self._lock:
+            for rowid in rowids:
+                entry = self._entries.pop((table, rowid), None)
+                if(entry is not None):
+                    self.nbytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions
+                , "entries": len(self._entries), "nbytes": self.nbytes, "max_bytes": self.max_bytes}
+
+
+class DBConnection(sqlite3.Connection):
+    """
+    Connection that holds its ``DBContext``, such that the context lives exactly as long
+    as the connection. ``open_database`` returns these connections.
+
+    ``readonly`` is True for connections opened with ``mode="ro"``.
+    """
+    _db_context = None
+    readonly = False
+
+
+class DBContext:
+    """
+    Use ``DBContext.of(connection)`` to get the context of a connection.
+
+    The context of a ``DBConnection`` is stored on the connection. Plain ``sqlite3.Connection``
+    objects cannot hold attributes or be weakly referenced; keeping their contexts would keep
+    the connections open. They get a new context every time, i.e., nothing is cached for them
+    and the value cache cannot be enabled. Use ``open_database`` to get a ``DBConnection``.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, connection: sqlite3.Connection):
+        if(isinstance(connection, DBConnection)):
+            # No reference cycle with the connection.
+            self._connection = weakref.ref(connection)
+        else:
+            self._connection = lambda: connection
+        self._basepath = None
+        self._value_cache = None
+        self._data_version = None
+
+    @classmethod
+    def of(cls, connection: sqlite3.Connection):
+        if(not isinstance(connection, DBConnection)):
+            return cls(connection)
+        with cls._lock:
+            if(connection._db_context is None):
+                connection._db_context = cls(connection)
+            return connection._db_context
+
+    @classmethod
+    def forget(cls, connection: sqlite3.Connection):
+        """
+        Drop the context of ``connection``.
+        """
+        if(isinstance(connection, DBConnection)):
+            connection._db_context = None
+
+    def enable_value_cache(self, max_bytes=2**28):
+        """
+        Cache values loaded by ``DBValue.load`` and ``Measurement.load`` on this connection
+        in a ``ValueCache`` of ``max_bytes`` bytes. Returns the cache.
+        Requires a ``DBConnection``.
+        """
+        if(not isinstance(self._connection(), DBConnection)):
+            raise ValueError("the value cache requires a DBConnection, use open_database")
+        if(self._value_cache is None):
+            self._value_cache = ValueCache(max_bytes)
+            self._data_version = None
+        self._value_cache.max_bytes = max_bytes
+        return self._value_cache
+
+    def disable_value_cache(self):
+        self._value_cache = None
+
+    @property
+    def value_cache(self):
+        """
+        The ``ValueCache`` or None. The cache is cleared if other connections committed
+        changes since the last access.
+        """
+        cache = self._value_cache
+        if(cache is None):
+            return None
+        data_version = self._connection().execute("PRAGMA data_version").fetchone()[0]
+        if(data_version != self._data_version):
+            cache.clear()
+            self._data_version = data_version
+        return cache
+
+    def invalidate(self, table: str, rowids):
+        """
+        Drop the rows of ``table`` from the value cache. Must be called when values are
+        deleted using this connection.
+        """
+        if(self._value_cache is not None):
+            self._value_cache.invalidate(table, rowids)
+
+    @property
+    def basepath(self):
+        """
+        The absolute path of the file storage for external values.
+        """
+        if(self._basepath is None):
+            c = self._connection().execute("SELECT abspath FROM db_meta")
+            result = c.fetchone()
+            if(result is None):
+                raise ValueError("database has no file storage path. Use schema_init to initialize the database.")
+            self._basepath = pathlib.Path(result[0])
+        return self._basepath
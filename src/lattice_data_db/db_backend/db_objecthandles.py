@@ -4,11 +4,64 @@ import sqlite3
 import numpy
 import uuid
 import pathlib
+import contextlib
 
 from .array_converter import sentinel
+from .context import DBContext
+from ..load_promise import LoadPromiseResolver
+
+_load_promises = LoadPromiseResolver(globals())
+
+
+@contextlib.contextmanager
+def _transaction(connection: sqlite3.Connection, handles=()):
+    """
+    Run the block in one transaction. Commits on success, rolls back on error.
+    If the caller already opened a transaction, the block runs in a savepoint instead:
+    The caller's transaction is neither committed nor rolled back.
+
+    On error, the ``_id`` of the ``handles`` that were not stored before is reset to None.
+    """
+    new_handles = [handle for handle in handles if handle._id is None]
+    savepoint = None
+    if(connection.in_transaction):
+        savepoint = f"_transaction_{uuid.uuid4().hex}"
+        connection.execute(f"SAVEPOINT {savepoint}")
+    else:
+        connection.execute("BEGIN")
+    try:
+        yield
+    except:
+        if(savepoint is None):
+            connection.rollback()
+        else:
+            connection.execute(f"ROLLBACK TO {savepoint}")
+            connection.execute(f"RELEASE {savepoint}")
+        for handle in new_handles:
+            handle._id = None
+        raise
+    if(savepoint is None):
+        connection.commit()
+    else:
+        connection.execute(f"RELEASE {savepoint}")
+
+def _insert_many(connection: sqlite3.Connection, statement: str, rows):
+    """
+    ``executemany`` the INSERT ``statement`` and return the rowids of the inserted rows.
+    Must be called inside a transaction: Then no other writer can interleave and SQLite
+    allocates the rowids consecutively, such that they follow from ``LAST_INSERT_ROWID()``.
+    """
+    if(len(rows) == 0):
+        return []
+    cursor = connection.cursor()
+    cursor.executemany(statement, rows)
+    last = cursor.execute("SELECT LAST_INSERT_ROWID()").fetchone()[0]
+    return list(range(last - len(rows) + 1, last + 1))
 
 
 class DBValue:
+    __slots__ = ("_is_external", "_value", "_store_file", "_promise_loadfile", "_id")
+
     def __init__(self, value, store_file=None, promise_loadfile="", loading_from_db=False, id=None):
         self._is_external = False
         if(isinstance(value, (int, float, complex))):
@@ -24,54 +77,85 @@ class DBValue:
         self._promise_loadfile = promise_loadfile 
         self._id = id
 
-    def _get_unique_filename(self, connection: sqlite3.Connection):
-        # Get the rowid the value will have:
-        cursor = connection.cursor()
-        c = cursor.execute("SELECT MAX(rowid) FROM data_values")
-        rowid = c.fetchone()[0]
-        if(rowid is None):
-            rowid = 0
-        rowid += 1
-
-
+    def _get_unique_filename(self, rid: int):
         my_uuid = uuid.uuid1()
 
-        filename = f"{rowid}-{my_uuid.hex}"
+        filename = f"{rid}-{my_uuid.hex}"
         return filename
 
     @classmethod
     def get_basepth(cls, connection: sqlite3.Connection):
-        cursor = connection.cursor()
-        c = cursor.execute("SELECT abspath FROM db_meta")
-        return pathlib.Path(c.fetchone()[0])
+        return DBContext.of(connection).basepath
 
 
     def store(self, connection: sqlite3.Connection):
         """
         Store the value in the database, either as numpy array or as external file.
         """
+        with _transaction(connection, [self]):
+            rid = self._insert(connection)
+        return rid
+
+    def _insert(self, connection: sqlite3.Connection):
+        """
+        Insert the value without committing. Must be called inside a transaction.
+        """
         if(self._is_external):
             if(self._store_file is None):
                 raise ValueError("Missing store_file. This is either because you forgot to supply it or because the value was loaded from database. In the latter case, monkey patch it.")
-            fname = self._get_unique_filename(connection)
             basepath = self.__class__.get_basepth(connection)
 
+            # The file name is derived from the rowid assigned by the INSERT.
+            # If storing the file fails, the transaction is rolled back.
+            cursor = connection.cursor()
+            cursor.execute("INSERT INTO data_values(is_inline, load_promise) VALUES(?, ?)", (0, self._promise_loadfile))
+            rid = cursor.lastrowid
+            fname = self._get_unique_filename(rid)
+
             outpath = basepath / fname 
             self._store_file(outpath, self._value)
-            
-            cursor = connection.cursor()
-            cursor.execute("INSERT INTO data_values(is_inline, load_promise, relapath) VALUES(?, ?, ?)", (0, self._promise_loadfile, fname))
-            rid = cursor.execute("SELECT LAST_INSERT_ROWID()").fetchone()[0]
+
+            cursor.execute("UPDATE data_values SET relapath=? WHERE rowid=?", (fname, rid))
 
         else:
             cursor = connection.cursor()
             cursor.execute("INSERT INTO data_values(is_inline, av) VALUES(?, ?)", (1, self._value))
-            rid = cursor.execute("SELECT LAST_INSERT_ROWID()").fetchone()[0]
+            rid = cursor.lastrowid
 
-        connection.commit()
         self._id = rid
         return rid
 
+    @classmethod
+    def store_many(cls, connection: sqlite3.Connection, values, chunk_size=1000):
+        """
+        Store many values in a single transaction. Inline values are inserted
+        using ``executemany`` in chunks of ``chunk_size``.
+        Returns the rowids of the values in the order of ``values``.
+        """
+        values = list(values)
+        with _transaction(connection, values):
+            for i in range(0, len(values), chunk_size):
+                cls._insert_many(connection, values[i:i + chunk_size])
+        return [v._id for v in values]
+
+    @classmethod
+    def _insert_many(cls, connection: sqlite3.Connection, values):
+        """
+        Insert the values that are not yet stored without committing.
+        """
+        inline = []
+        for value in values:
+            if(value._id is not None):
+                continue
+            if(value._is_external):
+                value._insert(connection)
+            else:
+                inline.append(value)
+
+        rids = _insert_many(connection, "INSERT INTO data_values(is_inline, av) VALUES(?, ?)", [(1, v._value) for v in inline])
+        for value, rid in zip(inline, rids):
+            value._id = rid
+
     @classmethod 
     def load(cls, connection: sqlite3.Connection, rid: int, store_file=None, locals=None):
         """
@@ -79,7 +163,16 @@ class DBValue:
 
         The keyword argument ``locals`` is either None or a dict supplying some locals for the load_promise 
         that is used to load data from file.
+
+        If the value cache of the connection is enabled (``DBContext.enable_value_cache``), array values 
+        loaded without ``locals`` are cached; cached arrays are read-only.
         """
+        cache = DBContext.of(connection).value_cache if locals is None else None
+        if(cache is not None):
+            entry = cache.get("data_values", rid)
+            if(entry is not None):
+                return cls._from_row(rid, *entry, store_file=store_file)
+
         cursor = connection.cursor()
         c = cursor.execute("SELECT is_inline, av, load_promise, relapath FROM data_values where rowid=?", (rid,))
         result = c.fetchone()
@@ -92,20 +185,29 @@ class DBValue:
         if(is_inline):
             if(not isinstance(av, numpy.ndarray)):
                 raise TypeError("failed to load array value as numpy array; use ``detect_types=sqlite3.PARSE_DECLTYPES``.")
-            return cls(av, id=rid)
-
-
-        basepath = pathlib.Path(cls.get_basepth(connection))
-
-        if(locals is not None):
-            ctx = globals()
-            ctx.update(locals)
-            value = eval(load_promise, ctx)(str(basepath / relapath))
+            value = av
         else:
-            value = eval(load_promise)(str(basepath / relapath))
+            basepath = pathlib.Path(cls.get_basepth(connection))
+            value = cls._load_file(basepath, load_promise, relapath, locals=locals)
+
+        if(cache is not None and isinstance(value, numpy.ndarray)):
+            value.setflags(write=False)
+            cache.put("data_values", rid, (is_inline, value, load_promise), value.nbytes)
+        return cls._from_row(rid, is_inline, value, load_promise, store_file=store_file)
 
+    @classmethod
+    def _from_row(cls, rid, is_inline, value, load_promise, store_file=None):
+        if(is_inline):
+            return cls(value, id=rid)
         return cls(value, promise_loadfile=load_promise, loading_from_db=True, store_file=store_file, id=rid)
 
+    @staticmethod
+    def _load_file(basepath: pathlib.Path, load_promise: str, relapath: str, locals=None):
+        """
+        Load an external value using its ``load_promise``.
+        """
+        return _load_promises.resolve(load_promise, locals=locals)(str(basepath / relapath))
+
     def __str__(self):
         return str(self._value)
 
@@ -114,6 +216,8 @@ class DBValue:
 
 
 class Ensemble:
+    __slots__ = ("_name", "_abspath", "_description", "_id")
+
     def __init__(self, name, abspath, description, id=None):
         self._name = name 
         self._abspath = abspath 
@@ -158,6 +262,8 @@ class Ensemble:
 
 
 class Configuration:
+    __slots__ = ("_ensemble", "_relapath", "_load_promise", "_id")
+
     def __init__(self, ensemble, relapath, load_promise, id=None):
         if(isinstance(ensemble, Ensemble)):
             if(ensemble._id is None):
@@ -204,6 +310,8 @@ class Collection:
     """
     The ``._configurations`` attribute is always a list of configuration ids.
     """
+    __slots__ = ("_name", "_configurations", "_id")
+
     def __init__(self, name, configurations, id=None):
         self._name = name 
 
@@ -226,6 +334,28 @@ class Collection:
 
         return rid
 
+    def add_configurations(self, connection: sqlite3.Connection, configurations):
+        """
+        Append configurations to the stored collection in one transaction.
+        Configurations that are already in the collection are skipped.
+        Returns the ids of the added configurations.
+        """
+        if(self._id is None):
+            raise ValueError("collection is not yet registered in database")
+
+        known = set(self._configurations)
+        added = []
+        for c in configurations:
+            cid = configuration2id(c)
+            if(cid not in known):
+                known.add(cid)
+                added.append(cid)
+
+        with _transaction(connection):
+            connection.executemany("INSERT INTO collections_contains VALUES(?, ?)", [(self._id, c) for c in added])
+        self._configurations.extend(added)
+        return added
+
     @classmethod
     def load(cls, connection: sqlite3.Connection, rid: int):
         cursor = connection.cursor()
@@ -259,6 +389,8 @@ class Measurement:
     ``._configuration`` is always configuration id.
     ``._value`` is always DBValue.
     """
+    __slots__ = ("_configuration", "_value", "_name", "_id")
+
     def __init__(self, configuration, value: DBValue, name: str, id=None):
         self._configuration = configuration2id(configuration)
         self._value = value 
@@ -279,20 +411,135 @@ class Measurement:
         return rid
 
     @classmethod
-    def load(cls, connection: sqlite3.Connection, rid: int, locals=None):
+    def store_many(cls, connection: sqlite3.Connection, measurements, chunk_size=1000):
         """
-        ``locals`` are passed to ``DBValue``.
+        Store many measurements (and their values) in a single transaction using
+        ``executemany`` in chunks of ``chunk_size``. This is much faster than
+        calling ``store`` for every measurement, which commits every time.
+        Returns the rowids of the measurements in the order of ``measurements``.
         """
-        cursor = connection.cursor()
-        c = cursor.execute("SELECT configuration, value, name FROM measurements where rowid=?", (rid,))
-        result = c.fetchone()
+        measurements = list(measurements)
+        rids = []
+        with _transaction(connection, measurements + [m._value for m in measurements]):
+            for i in range(0, len(measurements), chunk_size):
+                rids.extend(cls._insert_many(connection, measurements[i:i + chunk_size]))
+        return rids
+
+    @classmethod
+    def _insert_many(cls, connection: sqlite3.Connection, measurements):
+        """
+        Insert the measurements and their values without committing.
+        """
+        DBValue._insert_many(connection, [m._value for m in measurements])
+
+        rids = _insert_many(connection, "INSERT INTO measurements VALUES(?, ?, ?)"
+                            , [(m._configuration, m._value._id, m._name) for m in measurements])
+        for m, rid in zip(measurements, rids):
+            m._id = rid
+        return rids
 
+    @classmethod
+    def load(cls, connection: sqlite3.Connection, rid: int, locals=None):
+        """
+        ``locals`` are passed to ``DBValue``. Uses the value cache, if enabled, see ``DBValue.load``.
+        """
+        cache = DBContext.of(connection).value_cache
+        result = None if cache is None else cache.get("measurements", rid)
         if(result is None):
-            raise ValueError(f"measurement with id {rid} not found in DB")
+            cursor = connection.cursor()
+            c = cursor.execute("SELECT configuration, value, name FROM measurements where rowid=?", (rid,))
+            result = c.fetchone()
+
+            if(result is None):
+                raise ValueError(f"measurement with id {rid} not found in DB")
+            if(cache is not None):
+                # rough size of the row.
+                cache.put("measurements", rid, result, 64 + len(result[2]))
 
-        
         configuration, value, name = result
         value = DBValue.load(connection, value, locals=locals)
 
 
         return cls(configuration, value, name, id=rid)
+
+
+class ConfigurationBatch:
+    """
+    Columnar representation of many configurations: ``ids`` and ``ensembles`` are integer
+    arrays, ``relapaths`` and ``load_promises`` are object arrays of strings (or None for NULL).
+    Indexing with an integer returns a ``Configuration``, indexing with a slice or an index
+    array returns a ``ConfigurationBatch``.
+    """
+    __slots__ = ("ids", "ensembles", "relapaths", "load_promises")
+
+    def __init__(self, ids, ensembles, relapaths, load_promises):
+        self.ids = numpy.asarray(ids, dtype=numpy.int64)
+        self.ensembles = numpy.asarray(ensembles, dtype=numpy.int64)
+        # dtype=str would turn NULL into "None".
+        self.relapaths = numpy.asarray(relapaths, dtype=object)
+        self.load_promises = numpy.asarray(load_promises, dtype=object)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build the batch from ``(id, ensemble, relapath, load_promise)`` rows.
+        """
+        rows = list(rows)
+        if(len(rows) == 0):
+            return cls([], [], [], [])
+        return cls(*zip(*rows))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if(isinstance(index, (int, numpy.integer))):
+            return Configuration(int(self.ensembles[index]), self.relapaths[index], self.load_promises[index], id=int(self.ids[index]))
+        return self.__class__(self.ids[index], self.ensembles[index], self.relapaths[index], self.load_promises[index])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_list(self):
+        return list(self)
+
+
+class MeasurementBatch:
+    """
+    Columnar representation of many measurements: ``ids``, ``configurations`` (configuration ids) 
+    and ``values`` (data_values ids) are integer arrays, ``names`` is an object array of strings.
+    The values are not loaded; use ``DBValue.load``.
+    """
+    __slots__ = ("ids", "configurations", "values", "names")
+
+    def __init__(self, ids, configurations, values, names):
+        self.ids = numpy.asarray(ids, dtype=numpy.int64)
+        self.configurations = numpy.asarray(configurations, dtype=numpy.int64)
+        self.values = numpy.asarray(values, dtype=numpy.int64)
+        self.names = numpy.asarray(names, dtype=object)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build the batch from ``(id, configuration, value, name)`` rows.
+        """
+        rows = list(rows)
+        if(len(rows) == 0):
+            return cls([], [], [], [])
+        return cls(*zip(*rows))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if(isinstance(index, (int, numpy.integer))):
+            raise TypeError("measurements in a batch have no loaded values; use batch.load(connection, i)")
+        return self.__class__(self.ids[index], self.configurations[index], self.values[index], self.names[index])
+
+    def load(self, connection: sqlite3.Connection, index: int, locals=None):
+        """
+        Load the measurement ``index`` of the batch, see ``Measurement.load``.
+        """
+        return Measurement(int(self.configurations[index]), DBValue.load(connection, int(self.values[index]), locals=locals)
+                           , self.names[index], id=int(self.ids[index]))
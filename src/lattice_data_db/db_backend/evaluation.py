@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Evaluation runs: Measure all configurations of a collection that are missing a measurement.
+"""
+
+import sqlite3
+import datetime
+import time
+import concurrent.futures
+
+from .db_objecthandles import Measurement, DBValue, _transaction
+from .tasks import find_missing_configurations_for_collection, _find_collection_id
+
+
+def _evaluate(function, configuration):
+    # Runs in the workers.
+    start = time.perf_counter()
+    try:
+        value, error = function(configuration), None
+    except Exception as e:
+        value, error = None, f"{type(e).__name__}: {e}"
+    return configuration._id, value, time.perf_counter() - start, error
+
+
+class EvaluationRun:
+    """
+    Evaluates ``function(configuration)`` on all configurations of the collection ``collection_name``
+    on which ``measurement_name`` has not been measured and stores the results as measurements.
+
+    The configurations are dispatched to ``workers`` processes (``executor="process"``,
+    ``function`` must be picklable) or threads (``executor="thread"``). At most ``max_in_flight``
+    (default: ``2 * workers``) tasks are submitted at the same time, which bounds the memory used
+    by results that are not yet written. The workers return the values; the results of
+    ``batch_size`` tasks are written together in one transaction.
+    The values are stored inline, or, if ``store_file`` is given, as external files
+    (see ``DBValue``).
+
+    Every task is recorded in ``evaluation_tasks`` with its run time and error, if it failed.
+    A run that did not finish (e.g., because of a crash) is resumed by ``run``: only configurations
+    without measurement are evaluated and the tasks are recorded for the unfinished run.
+    """
+    def __init__(self, connection: sqlite3.Connection, collection_name: str, measurement_name: str, function
+                 , workers=4, executor="process", batch_size=64, store_file=None, promise_loadfile="", max_in_flight=None):
+        if(executor not in ("thread", "process")):
+            raise ValueError(f"unknown executor: {executor}")
+        self._connection = connection
+        self._collection_name = collection_name
+        self._measurement_name = measurement_name
+        self._function = function
+        self._workers = workers
+        self._executor = executor
+        self._batch_size = batch_size
+        self._max_in_flight = 2 * workers if max_in_flight is None else max_in_flight
+        self._store_file = store_file
+        self._promise_loadfile = promise_loadfile
+
+        self.run_id = None
+        self.n_done = 0
+        # configuration id -> error message
+        self.failures = {}
+
+    def _start(self):
+        """
+        Continue the last unfinished run or start a new one.
+        """
+        collection_id = _find_collection_id(self._connection, self._collection_name)
+        c = self._connection.execute("SELECT rowid FROM evaluation_runs WHERE collection = ? AND name = ? AND finished IS NULL ORDER BY rowid DESC"
+                                     , (collection_id, self._measurement_name))
+        row = c.fetchone()
+        if(row is not None):
+            return row[0]
+
+        with _transaction(self._connection):
+            c = self._connection.execute("INSERT INTO evaluation_runs VALUES(?, ?, ?, NULL)"
+                                         , (collection_id, self._measurement_name, datetime.datetime.now().isoformat()))
+        return c.lastrowid
+
+    def _value(self, value):
+        if(self._store_file is None):
+            return DBValue(value)
+        return DBValue(value, store_file=self._store_file, promise_loadfile=self._promise_loadfile)
+
+    def _write(self, results):
+        """
+        Store the measurements and the task records of ``results`` in one transaction.
+        """
+        measurements = [Measurement(cid, self._value(value), self._measurement_name) for cid, value, _, error in results if error is None]
+        with _transaction(self._connection, measurements + [m._value for m in measurements]):
+            Measurement._insert_many(self._connection, measurements)
+            rids = iter(measurements)
+            self._connection.executemany("INSERT INTO evaluation_tasks VALUES(?, ?, ?, ?, ?)"
+                                         , [(self.run_id, cid, None if error is not None else next(rids)._id, seconds, error)
+                                            for cid, _, seconds, error in results])
+
+        self.n_done += len(measurements)
+        for cid, _, _, error in results:
+            if(error is not None):
+                self.failures[cid] = error
+
+    def run(self):
+        """
+        Evaluate all missing configurations. Returns the number of stored measurements;
+        failed tasks are listed in ``failures`` (both of this call). The run is finished if no task failed.
+
+        If the pool breaks (e.g., a worker process was killed), the results of the completed tasks
+        are stored before ``BrokenExecutor`` is raised; the remaining configurations are evaluated
+        when the run is resumed.
+        """
+        self.n_done = 0
+        self.failures = {}
+        self.run_id = self._start()
+        missing = find_missing_configurations_for_collection(self._connection, self._collection_name, self._measurement_name)
+
+        if(self._executor == "process"):
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=self._workers)
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers)
+
+        results = []
+        pending = set()
+        to_submit = iter(missing)
+        try:
+            while True:
+                for configuration in to_submit:
+                    pending.add(pool.submit(_evaluate, self._function, configuration))
+                    if(len(pending) >= self._max_in_flight):
+                        break
+
+                if(len(pending) == 0):
+                    break
+
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                broken = None
+                for future in done:
+                    try:
+                        results.append(future.result())
+                    except concurrent.futures.BrokenExecutor as e:
+                        broken = e
+                if(broken is not None):
+                    # Keep the completed tasks.
+                    self._write(results)
+                    raise broken
+                if(len(results) >= self._batch_size):
+                    self._write(results)
+                    results = []
+            self._write(results)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+        if(len(self.failures) == 0):
+            with _transaction(self._connection):
+                self._connection.execute("UPDATE evaluation_runs SET finished = ? WHERE rowid = ?", (datetime.datetime.now().isoformat(), self.run_id))
+        return self.n_done
+
+    def timing(self):
+        """
+        ``(configuration_id, seconds, error)`` of all tasks of the run.
+        """
+        c = self._connection.execute("SELECT configuration, seconds, error FROM evaluation_tasks WHERE run = ? ORDER BY rowid", (self.run_id,))
+        return c.fetchall()
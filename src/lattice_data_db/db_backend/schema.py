@@ -7,9 +7,88 @@ import warnings
 
 from .array_converter import sentinel
 
+SCHEMA_VERSION = 6
+
+def _migrate_v1(cursor: sqlite3.Cursor):
+    # Indexes on the join and lookup columns.
+    cursor.execute("CREATE INDEX IF NOT EXISTS measurements_name_configuration ON measurements(name, configuration)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS measurements_configuration ON measurements(configuration)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS collections_contains_collection_configuration ON collections_contains(collection, configuration)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS collections_contains_configuration ON collections_contains(configuration)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS configurations_ensemble ON configurations(ensemble)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ensembles_name ON ensembles(name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS collections_name ON collections(name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS means_collection_name ON means(collection, name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS jackknifes_collection_name_configuration ON jackknifes(collection, name, configuration)")
+
+def _migrate_v2(cursor: sqlite3.Cursor):
+    # The measurements that the means and jackknifes of (collection, name) were computed from.
+    cursor.execute("CREATE TABLE IF NOT EXISTS statistics_state(collection INT, name TEXT, n INT, max_measurement INT, checksum INT)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS statistics_state_collection_name ON statistics_state(collection, name)")
+
+def _migrate_v3(cursor: sqlite3.Cursor):
+    # The data_values id of the running sum of the measurements, see aly_db.statistics.
+    cursor.execute("ALTER TABLE statistics_state ADD COLUMN sum INT")
+
+def _migrate_v4(cursor: sqlite3.Cursor):
+    # Bootstrap index matrices, shared by all measurements on a collection.
+    cursor.execute("CREATE TABLE IF NOT EXISTS resample_indices(collection INT, seed INT, n_samples INT, n_conf INT, value INT)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS resample_indices_key ON resample_indices(collection, seed, n_samples, n_conf)")
+    # Blocked jackknife and bootstrap samples (one stacked value) and the fingerprint of their measurements.
+    cursor.execute("CREATE TABLE IF NOT EXISTS resamples(collection INT, name TEXT, method TEXT, parameter INT, seed INT, n INT, max_measurement INT, checksum INT, value INT)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS resamples_key ON resamples(collection, name, method, parameter, seed)")
+
+def _migrate_v5(cursor: sqlite3.Cursor):
+    # Evaluation runs and the timing of their tasks, see db_backend.evaluation.
+    cursor.execute("CREATE TABLE IF NOT EXISTS evaluation_runs(collection INT, name TEXT, started TEXT, finished TEXT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS evaluation_tasks(run INT, configuration INT, measurement INT, seconds REAL, error TEXT)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS evaluation_runs_collection_name ON evaluation_runs(collection, name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS evaluation_tasks_run ON evaluation_tasks(run)")
+
+def _migrate_v6(cursor: sqlite3.Cursor):
+    # Resamples are computed in configuration order and the index matrices are keyed by the
+    # configurations they are for. Drop the resamples computed in measurement order.
+    if(cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='data_values'").fetchone()[0]):
+        cursor.execute("DELETE FROM data_values WHERE rowid IN (SELECT value FROM resamples UNION SELECT value FROM resample_indices)")
+    cursor.execute("DELETE FROM resamples")
+    cursor.execute("DELETE FROM resample_indices")
+    cursor.execute("ALTER TABLE resample_indices ADD COLUMN configurations INT")
+    cursor.execute("DROP INDEX IF EXISTS resample_indices_key")
+    cursor.execute("CREATE UNIQUE INDEX resample_indices_key ON resample_indices(collection, seed, n_samples, n_conf, configurations)")
+
+# _migrations[i] upgrades the schema from version i to version i + 1.
+_migrations = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6]
+
+def schema_version(connection: sqlite3.Connection):
+    """
+    The schema version of the database. It is stored in ``PRAGMA user_version``;
+    databases created before schema versioning have version 0.
+    """
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+def schema_migrate(connection: sqlite3.Connection):
+    """
+    Upgrade the schema of an existing database to ``SCHEMA_VERSION``.
+    Returns the version of the database before the upgrade.
+    Automatically commits these changes.
+    """
+    version = schema_version(connection)
+    if(version > SCHEMA_VERSION):
+        raise ValueError(f"database schema version {version} is newer than the supported version {SCHEMA_VERSION}")
+
+    cursor = connection.cursor()
+    for new_version in range(version + 1, SCHEMA_VERSION + 1):
+        _migrations[new_version - 1](cursor)
+        # PRAGMA does not support parameters.
+        cursor.execute(f"PRAGMA user_version = {int(new_version)}")
+    connection.commit()
+
+    return version
+
 def schema_init(connection: sqlite3.Connection):
     """
     Initialize the database schema on the given connection.
+    The schema is brought to ``SCHEMA_VERSION`` using ``schema_migrate``.
     Automatically commits these changes.
     """
 
@@ -30,6 +109,7 @@ def schema_init(connection: sqlite3.Connection):
     cursor.execute("CREATE TABLE IF NOT EXISTS db_meta(abspath TEXT)")
 
     connection.commit()
+    schema_migrate(connection)
 
 
     # Find the abspath that will be used for external storage
@@ -1,38 +1,114 @@
 #!/usr/bin/env python3
 """
 Find and define computation tasks on the database.
+
+The functions return the configurations as ``Configuration`` objects (``output="objects"``),
+as numpy array of configuration ids (``output="ids"``), as ``ConfigurationRecord``
+named tuples (``output="records"``) or as one columnar ``ConfigurationBatch``
+(``output="batch"``). They use one query each.
 """
 
-import sqlite3 
-from .db_objecthandles import Collection, Configuration
+import sqlite3
+import collections
+import numpy
+from .db_objecthandles import Configuration, ConfigurationBatch, MeasurementBatch
+
+ConfigurationRecord = collections.namedtuple("ConfigurationRecord", ["id", "ensemble", "ensemble_relapath", "load_promise"])
+
+outputs = ("objects", "ids", "records", "batch")
+
+_configuration_columns = "configurations.rowid, configurations.ensemble, configurations.ensemble_relapath, configurations.load_promise"
+
+def _find_collection_id(connection: sqlite3.Connection, collection: str):
+    rids = [f[0] for f in connection.execute("SELECT rowid FROM collections WHERE name=?", (collection,))]
+    if(len(rids) == 0):
+        raise ValueError(f"collection not found: {collection}")
+    if(len(rids) > 1):
+        # name clash.
+        raise ValueError(f"name clash found: several collections with name {collection}")
+    return rids[0]
 
-def find_configurations_for_collection(connection: sqlite3.Connection, collection: str):
+def _output(rows, output: str):
     """
-    Find the configurations that are in the given collection. 
-    The collection is given by name, a list of Configuration objects are returned.
+    Convert rows of ``_configuration_columns`` to ``output``.
     """
-    coll = Collection.findby_name(connection, collection)
-    if(isinstance(coll, list)):
-        # name clash. 
-        raise ValueError(f"name clash found: several collections with name {collection}")
+    if(output == "ids"):
+        return numpy.array([row[0] for row in rows], dtype=numpy.int64)
+    if(output == "records"):
+        return [ConfigurationRecord(*row) for row in rows]
+    if(output == "batch"):
+        return ConfigurationBatch.from_rows(rows)
+    return [Configuration(ensemble, relapath, load_promise, id=cid) for cid, ensemble, relapath, load_promise in rows]
 
-    return [Configuration.load(connection, cid) for cid in coll._configurations]
+def _check_output(output: str):
+    if(output not in outputs):
+        raise ValueError(f"unknown output: {output}")
 
-def find_missing_configurations_for_collection(connection: sqlite3.Connection, collection: str, measurement_name: str):
+def find_configurations_for_collection(connection: sqlite3.Connection, collection: str, output="objects"):
+    """
+    Find the configurations that are in the given collection.
+    The collection is given by name, a list of Configuration objects are returned
+    (or ids or records, see ``output`` in the module docstring).
+    """
+    _check_output(output)
+    collection_id = _find_collection_id(connection, collection)
+
+    c = connection.execute(f"SELECT {_configuration_columns} FROM collections_contains "\
+                           "INNER JOIN configurations ON configurations.rowid = collections_contains.configuration "\
+                           "WHERE collections_contains.collection = ? "\
+                           "ORDER BY collections_contains.rowid", (collection_id,))
+    return _output(c.fetchall(), output)
+
+def find_missing_configurations_for_collection(connection: sqlite3.Connection, collection: str, measurement_name: str, output="objects"):
     """
     Finds all the configurations on which ``measurement_name`` has not been measured.
-    
+    See ``output`` in the module docstring.
     """
-    coll = Collection.findby_name(connection, collection)
-    if(isinstance(coll, list)):
-        # name clash. 
-        raise ValueError(f"name clash found: several collections with name {collection}")
+    _check_output(output)
+    collection_id = _find_collection_id(connection, collection)
+
+    c = connection.execute(f"SELECT {_configuration_columns} FROM collections_contains "\
+                           "INNER JOIN configurations ON configurations.rowid = collections_contains.configuration "\
+                           "LEFT JOIN measurements ON measurements.configuration = collections_contains.configuration AND measurements.name = ? "\
+                           "WHERE collections_contains.collection = ? AND measurements.rowid IS NULL "\
+                           "ORDER BY collections_contains.rowid", (measurement_name, collection_id))
+    return _output(c.fetchall(), output)
 
-    all_configurations =  coll._configurations
+def find_missing_configurations_for_measurements(connection: sqlite3.Connection, collection: str, measurement_names, output="objects"):
+    """
+    Like ``find_missing_configurations_for_collection`` for several measurements using one query.
+    Returns a dict mapping every measurement name to its missing configurations.
+    """
+    _check_output(output)
+    collection_id = _find_collection_id(connection, collection)
+    measurement_names = list(dict.fromkeys(measurement_names))
+    if(len(measurement_names) == 0):
+        return {}
 
-    cursor = connection.cursor()
-    c = cursor.execute("SELECT measurements.configuration FROM measurements INNER JOIN collections_contains ON measurements.configuration = collections_contains.configuration WHERE collections_contains.collection = ? AND measurements.name=?", (coll._id, measurement_name))
-    already_measured = {f[0] for f in c}
+    names = ", ".join(["(?)"] * len(measurement_names))
+    c = connection.execute(f"WITH names(name) AS (VALUES {names}) "\
+                           f"SELECT names.name, {_configuration_columns} FROM collections_contains "\
+                           "CROSS JOIN names "\
+                           "INNER JOIN configurations ON configurations.rowid = collections_contains.configuration "\
+                           "LEFT JOIN measurements ON measurements.configuration = collections_contains.configuration AND measurements.name = names.name "\
+                           "WHERE collections_contains.collection = ? AND measurements.rowid IS NULL "\
+                           "ORDER BY collections_contains.rowid", (*measurement_names, collection_id))
+
+    rows = {name: [] for name in measurement_names}
+    for row in c:
+        rows[row[0]].append(row[1:])
+    return {name: _output(name_rows, output) for name, name_rows in rows.items()}
+
+def find_measurements_for_collection(connection: sqlite3.Connection, collection: str, measurement_name: str):
+    """
+    Find the measurements ``measurement_name`` on the configurations of the collection.
+    Returns a ``MeasurementBatch``; the values are not loaded.
+    """
+    collection_id = _find_collection_id(connection, collection)
 
-    missing_configurations = [Configuration.load(connection, c) for c in all_configurations if c not in already_measured]
-    return missing_configurations
+    c = connection.execute("SELECT measurements.rowid, measurements.configuration, measurements.value, measurements.name "\
+                           "FROM collections_contains "\
+                           "INNER JOIN measurements ON measurements.configuration = collections_contains.configuration "\
+                           "WHERE collections_contains.collection = ? AND measurements.name = ? "\
+                           "ORDER BY measurements.rowid", (collection_id, measurement_name))
+    return MeasurementBatch.from_rows(c.fetchall())
@@ -4,15 +4,67 @@ import numpy
 import datetime
 import uuid
 import glob
+import hashlib
+import mmap
 import warnings
-import collections
 import copy
+import shutil
+import concurrent.futures
+import queue
+import threading
+import time
+import contextlib
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (Windows): only threads of one process are serialized.
+    fcntl = None
+
+from ..load_promise import LoadPromiseResolver
 
 
 """
 High throughput data store.
 """
 
+_load_promises = LoadPromiseResolver(globals())
+
+def _load_file(promise, path):
+    # Runs in process workers.
+    return _load_promises.resolve(promise)(path)
+
+def _fsync_file(path):
+    with open(path, "rb") as fin:
+        os.fsync(fin.fileno())
+
+def _fsync_dir(path):
+    # Make renames in the directory durable. Directories cannot be opened on Windows.
+    if(os.name == "nt"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class DataLoadError(Exception):
+    """
+    Loading the data of some tags failed. ``failures`` maps the tags to the exceptions.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(f"failed to load {len(failures)} tag(s): {', '.join(list(failures)[:10])}")
+
+class DataWriteError(Exception):
+    """
+    Storing the data of some tags failed. ``failures`` maps the tags to the exceptions.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(f"failed to store {len(failures)} tag(s): {', '.join(list(failures)[:10])}")
+
 class HTPStore:
     """
     High throughput data store. Uses individual files per measurement 
@@ -29,14 +81,79 @@ class HTPStore:
     The ``loadpromise`` must be a function taking a path and must read the data from file.
 
     ``all_data`` may not work if ``loadpromise`` requires ``locals`` being passed to ``get_data``.
+
+    Stores that keep numpy arrays (the default ``loadpromise`` or the named loader ``"npy"``)
+    can be opened with ``mmap_mode="r"``; then ``get_data`` returns memory-mapped arrays.
+
+    Synchronizing the journal appends the new entries to an index log (JSON lines,
+    ``db.index.<generation>.jsonl``) instead of rewriting ``db.info.json``.
+    The index log is compacted into ``db.info.json`` once it has more than 
+    ``max(compact_min_records, number of tags)`` records, see ``compact_index``.
+
+    With ``layout="sharded"`` data files are stored in two levels of subdirectories
+    (``data/ab/cd/<file>``, ``abcd`` being the prefix of the SHA1 hash of the file name)
+    and journal files in ``journal/ef/``. This keeps directories small for stores
+    with very many entries. Use ``convert_layout`` to convert existing stores.
+
+    The data of a group can be packed into a few large segment files using ``pack_group``.
+
+    Every ``store`` increments the counter in ``db.jrnl_counter`` (an 8 byte integer that is
+    rewritten in place) after writing its journal entry. ``synced_journal`` only looks for
+    journal files if the counter changed since the last check, such that ``tags``, ``groups``
+    and ``meta`` are cheap. ``sync_journal`` increments the counter after removing journal
+    files, such that other instances notice the sync.
+
+    Data files, journal entries, segments and ``db.info.json`` are written to temporary
+    files and renamed into place; journal entries are written only after the data files
+    have been renamed. The ``fsync`` policy trades durability against throughput:
+
+    - ``"none"``: no ``fsync``. A crash can lose recent data, but the rename order is kept.
+    - ``"batch"``: ``store`` only writes the data files; the journal entries of
+      ``fsync_batch_size`` stores (or of all stores since the last call to ``flush``) are
+      committed together: the data files are synced, then one journal file with all entries
+      is written and synced. Call ``close`` (or use the store as context manager) to commit
+      the remaining entries.
+    - ``"always"``: every data file and journal entry is synced before ``store`` returns.
+
+    Several processes can store into and synchronize the same database: ``sync_journal``,
+    ``compact_index``, ``pack_group`` and ``convert_layout`` hold an exclusive lock on
+    ``db.lock`` (``fcntl.flock``) and first load the changes made by other processes.
+    Use ``refresh`` to load these changes in a reader.
     """
     dbinfo_name = "db.info.json"
     jrnl_prefix = "db.jrnl."
-    def __init__(self, name, abspath, loadpromise, store, info, readonly):
+    index_prefix = "db.index."
+    compact_min_records = 1024
+    jrnl_counter_name = "db.jrnl_counter"
+    lock_name = "db.lock"
+    tmp_dir = ".tmp"
+    # entries of tmp_dir older than this (seconds) are left over by crashed writers.
+    tmp_max_age = 24 * 3600
+    fsync_policies = ("none", "batch", "always")
+    fsync_batch_size = 64
+    layouts = ("flat", "sharded")
+    npy_loadpromises = ("lambda s: numpy.load(s + '.npy')", "npy")
+    segment_dir = "segments"
+    segment_alignment = 64
+    # number of threads used by ``all_data``.
+    load_workers = 1
+    data_dir = "data"
+    jrnl_dir = "journal"
+    def __init__(self, name, abspath, loadpromise, store, info, readonly, mmap_mode=None, fsync="none"):
         self._name = name
         self._loadpromise = loadpromise 
+        self._read_promise = loadpromise
+        if(mmap_mode is not None):
+            if(loadpromise not in self.npy_loadpromises):
+                raise ValueError(f"mmap_mode requires a numpy load promise (one of {self.npy_loadpromises})")
+            self._read_promise = f"npy:{mmap_mode}"
         self._store = store
         self._abspath = abspath
+        if(fsync not in self.fsync_policies):
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self._fsync = fsync
+        self._pending = []
+        self._pending_lock = threading.Lock()
 
         self._full_path = os.path.join(abspath, name)
         if(not os.path.exists(self._full_path)):
@@ -46,14 +163,28 @@ class HTPStore:
         self._info = info 
         self._readonly = readonly
 
+        self._load_index()
+        self._created_dirs = set()
+        self._segments = {}
+        # (journal counter, synced_journal) of the last check.
+        self._jrnl_check = (None, None)
+        # (inode, mtime, size) of the loaded db.info.json.
+        self._info_stat = None
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
 
     @classmethod 
-    def new(cls, name, abspath=None, loadpromise="lambda s: numpy.load(s + '.npy')", store=numpy.save):
+    def new(cls, name, abspath=None, loadpromise="lambda s: numpy.load(s + '.npy')", store=numpy.save, layout="flat", mmap_mode=None, fsync="none"):
         """
         Creates a new HTPStore and returns a new HTPStore object associated with it.
+        ``layout`` is either ``"flat"`` or ``"sharded"``, see class docstring.
         """
         if(abspath is None):
             abspath = os.getcwd()
+        if(layout not in cls.layouts):
+            raise ValueError(f"unknown layout: {layout}")
 
         full_path = os.path.join(abspath, name)
         os.makedirs(full_path)
@@ -69,6 +200,9 @@ class HTPStore:
                              , "dbinfoname": cls.dbinfo_name
                              , "glossary": "https://github.com/daknuett/lattice_data_db"
                              , "loadpromise": loadpromise
+                             , "indexprefix": cls.index_prefix
+                             , "indexgeneration": 0
+                             , "layout": layout
                          }
                 , "data_tags": []
                 , "data_info": {}
@@ -77,12 +211,14 @@ class HTPStore:
         with open(os.path.join(full_path, cls.dbinfo_name), "w") as dbinfo_file:
             json.dump(info, dbinfo_file)
 
-        return cls.open(name, syncjournal=False, store=store, abspath=abspath)
+        return cls.open(name, syncjournal=False, store=store, abspath=abspath, mmap_mode=mmap_mode, fsync=fsync)
 
     @classmethod
-    def open(cls, name, syncjournal=False, store=numpy.save, abspath=None, readonly=False):
+    def open(cls, name, syncjournal=False, store=numpy.save, abspath=None, readonly=False, mmap_mode=None, fsync="none"):
         """
         Opens an existing HTPStore, synchronizes the journal, if syncjournal is True.
+        If ``mmap_mode`` is not None, numpy data is memory-mapped using this mode.
+        ``fsync`` is the fsync policy, see class docstring.
         """
         if(abspath is None):
             abspath = os.getcwd()
@@ -91,16 +227,81 @@ class HTPStore:
         if(not os.path.exists(full_path)):
             raise ValueError("database does not exist. use HTPStore.new() to create it.")
 
-        with open(os.path.join(full_path, cls.dbinfo_name), "r") as dbinfo_file:
-            info = json.load(dbinfo_file)
+        info, info_stat = cls._read_info(os.path.join(full_path, cls.dbinfo_name))
 
-        db = cls(name, abspath, info["info"]["loadpromise"], store, info, readonly)
+        db = cls(name, abspath, info["info"]["loadpromise"], store, info, readonly, mmap_mode=mmap_mode, fsync=fsync)
+        db._info_stat = info_stat
 
         if(syncjournal):
             db.sync_journal()
 
         return db
 
+    @staticmethod
+    def _read_info(path):
+        with open(path, "r") as dbinfo_file:
+            info = json.load(dbinfo_file)
+            stat = os.fstat(dbinfo_file.fileno())
+        return info, (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the exclusive lock on the database. The lock is reentrant; acquiring it
+        refreshes the database info, see ``refresh``.
+        Read-only stores never take the lock; they do not write.
+        """
+        if(self._readonly):
+            raise Exception("database is in read only mode")
+        with self._thread_lock:
+            if(self._lock_depth == 0):
+                lock_file = open(os.path.join(self._full_path, self.lock_name), "ab")
+                if(fcntl is not None):
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._lock_file = lock_file
+            self._lock_depth += 1
+            try:
+                if(self._lock_depth == 1):
+                    self.refresh()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if(self._lock_depth == 0):
+                    if(fcntl is not None):
+                        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def refresh(self):
+        """
+        Loads the changes other processes made to the database info.
+        ``db.info.json`` is only read if it has been replaced (by ``compact_index``),
+        otherwise only the new records of the index log are read.
+        Returns True if anything changed.
+        """
+        self._jrnl_check = (None, None)
+        dbinfo_path = os.path.join(self._full_path, self._dbinfo_name)
+        stat = os.stat(dbinfo_path)
+        if((stat.st_ino, stat.st_mtime_ns, stat.st_size) != self._info_stat):
+            self._info, self._info_stat = self._read_info(dbinfo_path)
+            self._load_index()
+            return True
+
+        try:
+            with open(self._index_path(), "rb") as index:
+                index.seek(self._index_offset)
+                lines = index.read().split(b"\n")
+        except FileNotFoundError:
+            # compacted in the meantime; the next refresh reads db.info.json.
+            return False
+
+        # lines[-1] is either empty or an incomplete record.
+        for line in lines[:-1]:
+            self._apply_index_record(json.loads(line))
+            self._index_records += 1
+            self._index_offset += len(line) + 1
+        return len(lines) > 1
+
     def fix_file_name(self, name):
         name = name.replace(":", "_colon_")
         name = name.replace(" ", "_ws_")
@@ -112,13 +313,17 @@ class HTPStore:
         """
         Store the data with the given name. 
         ``meta`` must be JSON serializable.
+
+        With ``fsync="batch"`` the journal entry is kept in memory until ``flush`` is called
+        (every ``fsync_batch_size`` stores and by ``close``). Entries that are not flushed are
+        lost when the store is dropped: call ``close`` or use the store as context manager.
+        A warning is issued if a store with pending entries is garbage collected.
         """
         if(self._readonly):
             raise Exception("database is in read only mode")
 
-        jrnl_name_suffix = uuid.uuid1().hex + uuid.uuid4().hex
-        jrnl_filename = self._info["info"]["jrnlprefix"] + jrnl_name_suffix
-        file_name = self.fix_file_name(name)
+        jrnl_filename = self._new_journal_filename()
+        file_name = self._payload_file(self.fix_file_name(name))
         jrnl_entry = {"name": name
                       , "file": file_name
                       , "jrnl_entry": jrnl_filename
@@ -126,79 +331,444 @@ class HTPStore:
                       , "group": group
                       , "meta": meta}
 
-        with open(os.path.join(self._full_path, jrnl_filename), "w") as jrnl:
+        # The journal entry is written only after the data has been stored.
+        payload_files = self._store_atomic(file_name, data)
+
+        if(self._fsync == "batch"):
+            with self._pending_lock:
+                self._pending.append((payload_files, jrnl_entry))
+                flush = len(self._pending) >= self.fsync_batch_size
+            if(flush):
+                self.flush()
+            return
+
+        self._write_journal(jrnl_filename, jrnl_entry, fsync=self._fsync == "always")
+
+    def _store_atomic(self, file_name, data):
+        """
+        Stores the data in a temporary directory and renames the resulting file(s) 
+        (the store function may add a suffix) into place. Returns the final paths.
+        """
+        tmp_dir = os.path.join(self._full_path, self.tmp_dir, uuid.uuid4().hex)
+        os.makedirs(tmp_dir)
+        try:
+            self._store(os.path.join(tmp_dir, os.path.basename(file_name)), data)
+        except:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        final_dir = os.path.dirname(os.path.join(self._full_path, file_name))
+        self._makedirs(final_dir)
+        paths = []
+        for f in os.listdir(tmp_dir):
+            if(self._fsync == "always"):
+                _fsync_file(os.path.join(tmp_dir, f))
+            os.replace(os.path.join(tmp_dir, f), os.path.join(final_dir, f))
+            paths.append(os.path.join(final_dir, f))
+        os.rmdir(tmp_dir)
+
+        if(self._fsync == "always"):
+            _fsync_dir(final_dir)
+        return paths
+
+    def _write_journal(self, jrnl_filename, jrnl_entry, fsync=False):
+        """
+        Writes the journal entry (or list of entries) to a temporary file and renames it into place.
+        """
+        tmp_dir = os.path.join(self._full_path, self.tmp_dir)
+        self._makedirs(tmp_dir)
+        tmp_path = os.path.join(tmp_dir, jrnl_filename)
+        with open(tmp_path, "w") as jrnl:
             json.dump(jrnl_entry, jrnl)
+            if(fsync):
+                jrnl.flush()
+                os.fsync(jrnl.fileno())
+
+        jrnl_path = self._journal_path(jrnl_filename)
+        self._makedirs(os.path.dirname(jrnl_path))
+        os.replace(tmp_path, jrnl_path)
+        if(fsync):
+            _fsync_dir(os.path.dirname(jrnl_path))
+
+        self._increment_journal_counter()
+
+    def _new_journal_filename(self):
+        return self._info["info"]["jrnlprefix"] + uuid.uuid1().hex + uuid.uuid4().hex
+
+    def flush(self):
+        """
+        Commits the journal entries of the pending stores (``fsync="batch"``):
+        Syncs their data files and writes one journal file containing all entries.
+        """
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = []
+        if(len(pending) == 0):
+            return
+
+        dirs = set()
+        for payload_files, _ in pending:
+            for f in payload_files:
+                _fsync_file(f)
+                dirs.add(os.path.dirname(f))
+        for d in dirs:
+            _fsync_dir(d)
+
+        jrnl_filename = self._new_journal_filename()
+        entries = [jrnl_entry for _, jrnl_entry in pending]
+        for jrnl_entry in entries:
+            jrnl_entry["jrnl_entry"] = jrnl_filename
+        self._write_journal(jrnl_filename, entries, fsync=True)
+
+    def async_writer(self, max_queue=64):
+        """
+        Returns an ``AsyncWriter`` that stores data in a background thread.
+        """
+        if(self._readonly):
+            raise Exception("database is in read only mode")
+        return AsyncWriter(self, max_queue=max_queue)
+
+    @property
+    def layout(self):
+        return self._info["info"].get("layout", "flat")
+
+    def _payload_file(self, file_name, layout=None):
+        """
+        The path of the data file ``file_name`` relative to the store.
+        """
+        if(layout is None):
+            layout = self.layout
+        if(layout == "sharded"):
+            digest = hashlib.sha1(file_name.encode("utf-8")).hexdigest()
+            return f"{self.data_dir}/{digest[:2]}/{digest[2:4]}/{file_name}"
+        return file_name
+
+    def _journal_path(self, jrnl_filename):
+        if(self.layout == "sharded"):
+            # the last characters are from uuid4 and uniformly distributed.
+            return os.path.join(self._full_path, self.jrnl_dir, jrnl_filename[-2:], jrnl_filename)
+        return os.path.join(self._full_path, jrnl_filename)
+
+    def _journal_files(self):
+        jrnl_prefix = self._info["info"]["jrnlprefix"]
+        if(self.layout == "sharded"):
+            return glob.glob(os.path.join(self._full_path, self.jrnl_dir, "*", jrnl_prefix) + "*")
+        return glob.glob(os.path.join(self._full_path, jrnl_prefix) + "*")
+
+    def _makedirs(self, path):
+        if(path in self._created_dirs):
+            return
+        os.makedirs(path, exist_ok=True)
+        self._created_dirs.add(path)
+
+    def _data_files(self):
+        """
+        Map all files in the data locations of the store to the tag they belong to.
+        The store function may append a suffix to the file name (e.g., ``.npy``).
+        """
+        tags_by_file = {os.path.basename(info["file"]): tag for tag, info in self._info["data_info"].items()}
+
+        if(self.layout == "sharded"):
+            candidates = glob.glob(os.path.join(self._full_path, self.data_dir, "*", "*", "*"))
+        else:
+            candidates = [os.path.join(self._full_path, f) for f in os.listdir(self._full_path)]
+
+        internal_prefixes = (".", self._dbinfo_name, self.jrnl_counter_name, self.lock_name, self._info["info"]["jrnlprefix"], self._info["info"].get("indexprefix", self.index_prefix))
+
+        data_files = []
+        for path in candidates:
+            base = os.path.basename(path)
+            if(base.startswith(internal_prefixes)):
+                continue
+            # Longest matching file name wins, i.e., ``a.b.npy`` belongs to ``a.b``, not to ``a``.
+            while(base not in tags_by_file and "." in base):
+                base = base.rsplit(".", 1)[0]
+            if(base not in tags_by_file or not os.path.isfile(path)):
+                continue
+            tag = tags_by_file[base]
+            if(os.path.dirname(path) != os.path.dirname(os.path.join(self._full_path, self._info["data_info"][tag]["file"]))):
+                continue
+            data_files.append((tag, path))
+        return data_files
 
-        self._store(os.path.join(self._full_path, file_name), data)
+    def convert_layout(self, layout):
+        """
+        Converts the store to the given layout, moving all data files.
+        The journal must be synced and no other process may write to the store
+        during the conversion. If the conversion fails, it can be restarted.
+        """
+        if(self._readonly):
+            raise Exception("database is in read only mode")
+        if(layout not in self.layouts):
+            raise ValueError(f"unknown layout: {layout}")
+        with self._locked():
+            self._convert_layout(layout)
+
+    def _convert_layout(self, layout):
+        if(not self.synced_journal):
+            raise Exception("journal must be synced before converting the layout")
+
+        for tag, path in self._data_files():
+            info = self._info["data_info"][tag]
+            new_file = self._payload_file(os.path.basename(info["file"]), layout=layout)
+            new_path = os.path.join(self._full_path, new_file) + os.path.basename(path)[len(os.path.basename(info["file"])):]
+            self._makedirs(os.path.dirname(new_path))
+            os.replace(path, new_path)
+
+        for info in self._info["data_info"].values():
+            info["file"] = self._payload_file(os.path.basename(info["file"]), layout=layout)
+        self._info["info"]["layout"] = layout
+        self.compact_index()
+
+    def _index_path(self):
+        info = self._info["info"]
+        return os.path.join(self._full_path, f"{info.get('indexprefix', self.index_prefix)}{info.get('indexgeneration', 0)}.jsonl")
+
+    def _apply_index_record(self, record):
+        if(record["op"] == "add"):
+            entry = record["entry"]
+            name = entry["name"]
+            self._info["data_tags"].append(name)
+            self._info["data_info"][name] = entry
+            if(entry["group"] is not None):
+                self._info["data_groups"].setdefault(entry["group"], []).append(name)
+        elif(record["op"] == "update"):
+            self._info["data_info"][record["name"]].update(record["changes"])
+        elif(record["op"] == "sync"):
+            self._info["info"]["lastjrnlsync"] = record["time"]
+        else:
+            raise ValueError(f"unknown index record: {record['op']}")
+
+    def _load_index(self):
+        """
+        Replay the index log on top of ``db.info.json``.
+        A truncated last record (from a crash while appending) is ignored.
+        """
+        self._index_records = 0
+        self._index_offset = 0
+
+        index_path = self._index_path()
+        if(not os.path.exists(index_path)):
+            return
+
+        with open(index_path, "rb") as index:
+            lines = index.read().split(b"\n")
+
+        # lines[-1] is either empty or an incomplete record.
+        for line in lines[:-1]:
+            self._apply_index_record(json.loads(line))
+            self._index_records += 1
+            self._index_offset += len(line) + 1
+
+    def _append_index(self, records, fsync=False):
+        index_path = self._index_path()
+        with open(index_path, "ab") as index:
+            if(index.tell() > self._index_offset):
+                # drop an incomplete record.
+                index.truncate(self._index_offset)
+                index.seek(self._index_offset)
+            data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+            index.write(data)
+            if(fsync or self._fsync != "none"):
+                index.flush()
+                os.fsync(index.fileno())
+
+        self._index_records += len(records)
+        self._index_offset += len(data)
+
+    def _write_info(self):
+        tmp_name = os.path.join(self._full_path, f".{self._dbinfo_name}.{uuid.uuid4().hex}")
+        with open(tmp_name, "w") as dbinfo_file:
+            json.dump(self._info, dbinfo_file)
+            if(self._fsync != "none"):
+                dbinfo_file.flush()
+                os.fsync(dbinfo_file.fileno())
+        os.replace(tmp_name, os.path.join(self._full_path, self._dbinfo_name))
+        stat = os.stat(os.path.join(self._full_path, self._dbinfo_name))
+        self._info_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if(self._fsync != "none"):
+            _fsync_dir(self._full_path)
+
+    def compact_index(self):
+        """
+        Writes the complete database info to ``db.info.json`` and starts a new, empty index log.
+        """
+        if(self._readonly):
+            raise Exception("database is in read only mode")
+        with self._locked():
+            self._compact_index()
+
+    def _compact_index(self):
+        old_index_path = self._index_path()
+        self._info["info"]["indexprefix"] = self._info["info"].get("indexprefix", self.index_prefix)
+        self._info["info"]["indexgeneration"] = self._info["info"].get("indexgeneration", 0) + 1
+        self._write_info()
+
+        self._index_records = 0
+        self._index_offset = 0
+        if(os.path.exists(old_index_path)):
+            os.remove(old_index_path)
 
     def get_now(self):
         return datetime.datetime.now().strftime(self._info["info"]["datetime.format"])
 
+    @staticmethod
+    def _journal_counter_value(data):
+        if(len(data) == 8):
+            return struct.unpack("<Q", data)[0]
+        # Older versions appended one byte per change.
+        return len(data)
+
+    def _journal_counter(self):
+        try:
+            with open(os.path.join(self._full_path, self.jrnl_counter_name), "rb") as counter:
+                return self._journal_counter_value(counter.read())
+        except FileNotFoundError:
+            return 0
+
+    def _increment_journal_counter(self):
+        """
+        Increments the journal counter in place, holding a lock on the counter file.
+        Returns the new value.
+        """
+        fd = os.open(os.path.join(self._full_path, self.jrnl_counter_name), os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+b") as counter:
+            if(fcntl is not None):
+                fcntl.flock(counter.fileno(), fcntl.LOCK_EX)
+            value = self._journal_counter_value(counter.read()) + 1
+            counter.seek(0)
+            counter.write(struct.pack("<Q", value))
+            counter.truncate(8)
+        # closing the file releases the lock.
+        return value
+
     @property
     def synced_journal(self):
-        jrnl_prefix = self._info["info"]["jrnlprefix"]
-        jrnl_files = glob.glob(os.path.join(self._full_path, jrnl_prefix) + "*")
-        if(len(jrnl_files) == 0):
-            return True
-        return False
+        counter = self._journal_counter()
+        if(counter == self._jrnl_check[0]):
+            return self._jrnl_check[1]
+
+        # The counter is read before looking for journal files: Any store that
+        # is not seen here changes the counter afterwards.
+        jrnl_files = self._journal_files()
+        synced = len(jrnl_files) == 0
+        self._jrnl_check = (counter, synced)
+        return synced
 
 
     def sync_journal(self):
-        jrnl_prefix = self._info["info"]["jrnlprefix"]
-        jrnl_files = glob.glob(os.path.join(self._full_path, jrnl_prefix) + "*")
+        """
+        Adds the journal entries to the database. Returns the number of tags added by this
+        call: 0 if there are no journal files (or for read-only stores, see below); entries that
+        another instance synced in the meantime are not counted.
+        The lock is only taken if there are journal files. Then temporary files older than
+        ``tmp_max_age`` seconds, which are left over by crashed writers, are removed as well.
+
+        Read-only stores do not write (the database may be on a read-only file system):
+        they only load the changes of other processes (see ``refresh``) and return 0.
+        """
+        if(self._readonly):
+            self.refresh()
+            return 0
+        self.flush()
+        counter = self._journal_counter()
+        if(len(self._journal_files()) == 0):
+            self._jrnl_check = (counter, True)
+            return 0
+        with self._locked():
+            return self._sync_journal()
+
+    def _sweep_tmp(self):
+        """
+        Removes the entries of the temporary directory that are older than ``tmp_max_age``.
+        Returns the number of removed entries.
+        """
+        try:
+            entries = list(os.scandir(os.path.join(self._full_path, self.tmp_dir)))
+        except FileNotFoundError:
+            return 0
+
+        now = time.time()
+        n_removed = 0
+        for entry in entries:
+            try:
+                if(now - entry.stat(follow_symlinks=False).st_mtime < self.tmp_max_age):
+                    continue
+                if(entry.is_dir(follow_symlinks=False)):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+                n_removed += 1
+            except FileNotFoundError:
+                # removed by its writer in the meantime.
+                continue
+        return n_removed
+
+    def _sync_journal(self):
+        self._sweep_tmp()
+        counter = self._journal_counter()
+        jrnl_files = self._journal_files()
         if(len(jrnl_files) == 0):
+            self._jrnl_check = (counter, True)
             return 0
 
         new_tags = []
         new_infos = {}
-        new_groups = collections.defaultdict(list)
         files_to_delete = []
 
 
         for jrnl_f in jrnl_files:
             with open(jrnl_f, "r") as jrnl:
-                jrnl_entry = json.load(jrnl)
+                jrnl_entries = json.load(jrnl)
+            # batch commits write several entries to one journal file.
+            if(not isinstance(jrnl_entries, list)):
+                jrnl_entries = [jrnl_entries]
 
-            name = jrnl_entry["name"]
+            delete = True
+            for jrnl_entry in jrnl_entries:
+                name = jrnl_entry["name"]
 
-            # Check in the dicts due to better performance.
-            if(name in new_infos):
-                raise Exception(f"journal entry doubler: {name} found but already in transaction (offending journal entry: {jrnl_entry['file']})")
-
-            if(name in self._info["data_info"]):
-                # resolve name collision
-                if(self._info["data_info"][name]["jrnl_entry_create"] == jrnl_entry["jrnl_entry_create"]):
-                    # Already synced.
-                    warnings.warn(f"found journal entry collision: journal entry {jrnl_entry['file']} not deleted but already synced")
-                    continue
-                # True collision
-                raise Exception(f"journal entry collision: {name} in database and {jrnl_entry['file']} exists")
+                # Check in the dicts due to better performance.
+                if(name in new_infos):
+                    raise Exception(f"journal entry doubler: {name} found but already in transaction (offending journal entry: {jrnl_entry['file']})")
 
-            if(jrnl_entry["group"] is not None):
-                new_groups[jrnl_entry["group"]].append(name)
-            new_tags.append(name)
-            jrnl_entry["jrnl_entry_sync"] = self.get_now()
-            new_infos[name] = jrnl_entry
-            files_to_delete.append(jrnl_f)
+                if(name in self._info["data_info"]):
+                    # resolve name collision
+                    if(self._info["data_info"][name]["jrnl_entry_create"] == jrnl_entry["jrnl_entry_create"]):
+                        # Already synced.
+                        warnings.warn(f"found journal entry collision: journal entry {jrnl_entry['file']} not deleted but already synced")
+                        delete = False
+                        continue
+                    # True collision
+                    raise Exception(f"journal entry collision: {name} in database and {jrnl_entry['file']} exists")
 
+                new_tags.append(name)
+                jrnl_entry["jrnl_entry_sync"] = self.get_now()
+                new_infos[name] = jrnl_entry
+            if(delete):
+                files_to_delete.append(jrnl_f)
 
-        self._info["data_tags"].extend(new_tags)
-        self._info["data_info"].update(new_infos)
-        self._info["info"]["lastjrnlsync"] = self.get_now()
 
-        for group, tags in new_groups.items():
-            if(group not in self._info["data_groups"]):
-                self._info["data_groups"][group] = tags
-            else:
-                self._info["data_groups"][group].extend(tags)
-
-        with open(os.path.join(self._full_path, self._dbinfo_name), "w") as dbinfo_file:
-            json.dump(self._info, dbinfo_file)
+        records = [{"op": "add", "entry": new_infos[name]} for name in new_tags]
+        records.append({"op": "sync", "time": self.get_now()})
+        self._append_index(records)
+        for record in records:
+            self._apply_index_record(record)
 
         for f in files_to_delete:
             os.remove(f)
+        synced = len(files_to_delete) == len(jrnl_files)
+        self._jrnl_check = (counter, synced)
+        if(len(files_to_delete) > 0):
+            # Other instances look for journal files again.
+            new_counter = self._increment_journal_counter()
+            # The result is only known if no store changed the counter in the meantime.
+            self._jrnl_check = (new_counter, synced) if new_counter == counter + 1 else (None, None)
+
+        if(self._index_records > max(self.compact_min_records, len(self._info["data_tags"]))):
+            self._compact_index()
 
-        return len(files_to_delete)
+        return len(new_tags)
 
     @property
     def tags(self):
@@ -219,23 +789,338 @@ class HTPStore:
         return copy.copy(self._info["data_info"])
 
 
+    def _data_path(self, tag):
+        return os.path.join(self._full_path, self._info["data_info"][tag]["file"])
+
     def get_data(self, tag, locals=None):
-        file_name = self._info["data_info"][tag]["file"]
-        if(locals is not None):
-            ctx = globals()
-            ctx.update(locals)
-            return eval(self._loadpromise, ctx)(os.path.join(self._full_path, file_name))
+        info = self._info["data_info"][tag]
+        if("segment" in info):
+            return self._read_packed(info)
+        return _load_promises.resolve(self._read_promise, locals=locals)(self._data_path(tag))
+
+    def _read_packed(self, info):
+        dtype = numpy.dtype(info["dtype"])
+        if(info["nbytes"] == 0):
+            # the segment may be empty and cannot be mapped.
+            return numpy.empty(info["shape"], dtype=dtype)
+
+        segment = info["segment"]
+        if(segment not in self._segments):
+            with open(os.path.join(self._full_path, segment), "rb") as fin:
+                self._segments[segment] = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        count = info["nbytes"] // dtype.itemsize
+        return numpy.frombuffer(self._segments[segment], dtype=dtype, count=count, offset=info["offset"]).reshape(info["shape"])
+
+    def pack_group(self, group, max_segment_bytes=2**30):
+        """
+        Packs the data of all synced tags in ``group`` that are not yet packed into segment 
+        files (``segments/<group>.<uuid>.seg``) and removes the individual data files.
+        Returns the number of packed tags.
+
+        A segment is the concatenation of the raw array buffers; ``data_info`` holds the offset,
+        dtype and shape of every tag. Packed data is read through one memory map per segment;
+        ``get_data`` returns read-only views for packed tags.
+
+        Packing requires a numpy load promise. New data is still written to individual files
+        through the journal and can be packed later.
+
+        The segments and the index are synced before the data files are removed, whatever
+        the ``fsync`` policy.
+        """
+        if(self._readonly):
+            raise Exception("database is in read only mode")
+        if(self._loadpromise not in self.npy_loadpromises):
+            raise ValueError(f"packing requires a numpy load promise (one of {self.npy_loadpromises})")
+        with self._locked():
+            return self._pack_group(group, max_segment_bytes)
+
+    def _pack_group(self, group, max_segment_bytes):
+        tags = [tag for tag in self._info["data_groups"].get(group, []) if "segment" not in self._info["data_info"][tag]]
+        if(len(tags) == 0):
+            return 0
+
+        segment_dir = os.path.join(self._full_path, self.segment_dir)
+        self._makedirs(segment_dir)
+        self._makedirs(os.path.join(self._full_path, self.tmp_dir))
+
+        records = []
+        segment_file = None
+        segment = None
+        def finish_segment():
+            segment_file.close()
+            _fsync_file(segment_file.name)
+            os.replace(segment_file.name, os.path.join(self._full_path, segment))
+
+        try:
+            for tag in tags:
+                data = numpy.load(self._data_path(tag) + ".npy")
+                if(data.dtype.fields is not None or data.dtype.hasobject):
+                    raise ValueError(f"cannot pack data of {tag} with dtype {data.dtype}")
+                if(not data.flags.c_contiguous):
+                    data = data.copy(order="C")
+
+                if(segment_file is None or segment_file.tell() + data.nbytes > max_segment_bytes):
+                    if(segment_file is not None):
+                        finish_segment()
+                    segment = f"{self.segment_dir}/{self.fix_file_name(group)}.{uuid.uuid4().hex}.seg"
+                    segment_file = open(os.path.join(self._full_path, self.tmp_dir, os.path.basename(segment)), "wb")
+
+                # align the data for the views.
+                offset = -(-segment_file.tell() // self.segment_alignment) * self.segment_alignment
+                segment_file.write(b"\0" * (offset - segment_file.tell()))
+                segment_file.write(data.reshape(-1).view(numpy.uint8))
+
+                records.append({"op": "update", "name": tag, "changes": {
+                                            "segment": segment
+                                            , "offset": offset
+                                            , "nbytes": data.nbytes
+                                            , "dtype": data.dtype.str
+                                            , "shape": list(data.shape)}})
+            finish_segment()
+        except:
+            if(segment_file is not None):
+                segment_file.close()
+                if(os.path.exists(segment_file.name)):
+                    os.remove(segment_file.name)
+            raise
+        _fsync_dir(segment_dir)
+
+        # The data files are removed only after the index points to the segments. This is
+        # synced independent of the fsync policy: after a crash the data would be lost.
+        self._append_index(records, fsync=True)
+        for record in records:
+            self._apply_index_record(record)
+        for tag in tags:
+            os.remove(self._data_path(tag) + ".npy")
+
+        return len(tags)
+
+    def close(self):
+        """
+        Commits pending journal entries and closes the memory maps of the segment files.
+        """
+        self.flush()
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # arrays still reference the map; it is released together with them.
+                pass
+        self._segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Do not flush here: this may run during interpreter shutdown.
+        pending = getattr(self, "_pending", [])
+        if(len(pending) > 0):
+            warnings.warn(f"{len(pending)} journal entries of {self._name} were not flushed (fsync=\"batch\"); call close or flush")
+
+    def iter_data_many(self, tags, workers=4, executor="thread", max_in_flight=None, locals=None):
+        """
+        Loads the data of ``tags`` concurrently using ``workers`` threads (``executor="thread"``)
+        or processes (``executor="process"``). At most ``max_in_flight`` (default: ``2 * workers``)
+        files are loaded at the same time, which bounds the memory used by results that
+        are not yet consumed.
+
+        Yields ``(index, tag, data, error)`` in the order of completion; ``index`` is the
+        position of ``tag`` in ``tags``. If loading a tag fails, ``data`` is None and ``error``
+        is the exception; the other tags are loaded nevertheless.
+
+        Process workers resolve the load promise themselves, so ``locals`` cannot be used
+        with ``executor="process"``.
+        """
+        if(max_in_flight is None):
+            max_in_flight = 2 * workers
+
+        if(executor == "thread"):
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            loader = _load_promises.resolve(self._read_promise, locals=locals)
+            submit = lambda path: pool.submit(loader, path)
+        elif(executor == "process"):
+            if(locals is not None):
+                raise ValueError("locals cannot be passed to process workers")
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            submit = lambda path: pool.submit(_load_file, self._read_promise, path)
         else:
-            return eval(self._loadpromise)(os.path.join(self._full_path, file_name))
+            raise ValueError(f"unknown executor: {executor}")
+
+        pending = {}
+        to_load = iter(enumerate(tags))
+        try:
+            while True:
+                for index, tag in to_load:
+                    try:
+                        if("segment" in self._info["data_info"][tag]):
+                            # packed data is read from the segment; no need for a worker.
+                            yield index, tag, self.get_data(tag), None
+                            continue
+                        path = self._data_path(tag)
+                    except KeyError as e:
+                        yield index, tag, None, e
+                        continue
+                    pending[submit(path)] = (index, tag)
+                    if(len(pending) >= max_in_flight):
+                        break
+
+                if(len(pending) == 0):
+                    break
+
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, tag = pending.pop(future)
+                    try:
+                        yield index, tag, future.result(), None
+                    except Exception as e:
+                        yield index, tag, None, e
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def get_data_many(self, tags, workers=4, executor="thread", max_in_flight=None, locals=None):
+        """
+        Loads the data of ``tags`` concurrently, see ``iter_data_many``.
+        Returns ``(data, failures)``: ``data`` is a list in the order of ``tags`` (with None for 
+        tags that failed to load) and ``failures`` maps these tags to the exceptions.
+        """
+        data = [None] * len(tags)
+        failures = {}
+        for index, tag, value, error in self.iter_data_many(tags, workers=workers, executor=executor, max_in_flight=max_in_flight, locals=locals):
+            if(error is not None):
+                failures[tag] = error
+            data[index] = value
+        return data, failures
 
     @property 
     def all_data(self):
         if(not self.synced_journal):
             warnings.warn("journal is not synced")
+        tags = self.tags
+        # This may not work. See docstring of class.
+        values, failures = self.get_data_many(tags, workers=self.load_workers)
+        if(len(failures) > 0):
+            raise DataLoadError(failures)
+
         data = {}
-        for tag in self.tags:
-            # This may not work. See docstring of class.
-            data[tag] = {"meta": self._info["data_info"][tag], "data": self.get_data(tag)}
+        for tag, value in zip(tags, values):
+            data[tag] = {"meta": self._info["data_info"][tag], "data": value}
 
         return  data
 
+
+class AsyncWriter:
+    """
+    Write-behind buffer for ``HTPStore.store``: ``store`` puts the data into a queue 
+    of size ``max_queue`` and returns immediately (it blocks only if the queue is full);
+    a background thread calls ``HTPStore.store``. Journal entries are written by
+    ``HTPStore.store``, i.e., only after the data has been stored.
+
+    The data must not be modified after it has been passed to ``store``.
+    ``flush`` waits until all queued data is written and raises ``DataWriteError``
+    if some writes failed. Use as context manager or call ``close``; if the block raises,
+    write errors are only reported as warning::
+
+        with store.async_writer() as writer:
+            for cfg in configurations:
+                writer.store(f"corr_{cfg}", measure(cfg), group="corr")
+    """
+    def __init__(self, store: HTPStore, max_queue=64):
+        self._store = store
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._closed = False
+
+        self._n_written = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="HTPStore.AsyncWriter", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if(item is None):
+                    return
+                name, data, group, meta = item
+                start = time.perf_counter()
+                self._store.store(name, data, group=group, meta=meta)
+                latency = time.perf_counter() - start
+                with self._lock:
+                    self._n_written += 1
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+            except Exception as e:
+                with self._lock:
+                    self._failures[name] = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_failures(self):
+        with self._lock:
+            failures = self._failures
+            self._failures = {}
+        if(len(failures) > 0):
+            raise DataWriteError(failures)
+
+    def store(self, name, data, group=None, meta={}):
+        """
+        Queue the data for storing, see ``HTPStore.store``.
+        Raises ``DataWriteError`` if previous writes failed.
+        """
+        if(self._closed):
+            raise Exception("writer is closed")
+        self._raise_failures()
+        self._queue.put((name, data, group, meta))
+
+    def flush(self):
+        """
+        Waits until all queued data is written.
+        """
+        self._queue.join()
+        self._store.flush()
+        self._raise_failures()
+
+    def close(self):
+        if(self._closed):
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._store.flush()
+        self._raise_failures()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if(exc_type is None):
+            self.close()
+            return
+        # Do not hide the exception that ends the block.
+        try:
+            self.close()
+        except Exception as e:
+            warnings.warn(f"closing the writer after {exc_type.__name__} failed: {e}")
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def metrics(self):
+        """
+        Queue depth, number of written entries and write latencies (seconds) of ``HTPStore.store``.
+        """
+        with self._lock:
+            return {"queue_depth": self._queue.qsize()
+                    , "written": self._n_written
+                    , "failed": len(self._failures)
+                    , "latency_mean": self._latency_total / self._n_written if self._n_written else 0.0
+                    , "latency_max": self._latency_max}
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+Resolve load promises.
+
+A load promise is either the source code of an expression that evaluates to a
+function taking a path, e.g., ``"lambda s: numpy.load(s + '.npy')"``, or the key of a
+named loader, e.g., ``"npy"``. Named loaders can take additional arguments that
+are separated by colons: ``"npy:r"`` passes ``"r"`` to the ``npy`` loader.
+
+Every distinct source is compiled and evaluated only once; the resulting
+functions are kept in an LRU cache. ``locals`` are resolved in a private
+namespace, i.e., module globals are never modified.
+"""
+
+import functools
+import numpy
+
+_named_loaders = {}
+
+def register_loader(name: str, loader):
+    """
+    Register a named loader. ``loader(path, *args)`` must load the data stored at ``path``.
+    The load promise ``"name:arg1:arg2"`` calls ``loader(path, "arg1", "arg2")``.
+    """
+    if(":" in name):
+        raise ValueError("loader names must not contain ':'")
+    _named_loaders[name] = loader
+
+def unregister_loader(name: str):
+    del _named_loaders[name]
+
+def named_loader(promise: str):
+    """
+    Returns the function for a named load promise or None if ``promise`` is not
+    the key of a registered loader.
+    """
+    name, _, args = promise.partition(":")
+    if(name not in _named_loaders):
+        return None
+
+    loader = _named_loaders[name]
+    if(args == ""):
+        return loader
+    args = args.split(":")
+    return lambda path: loader(path, *args)
+
+@functools.lru_cache(maxsize=1024)
+def _compile(source: str):
+    return compile(source, "<load promise>", "eval")
+
+
+class LoadPromiseResolver:
+    """
+    Resolves load promises in the namespace ``namespace``, usually ``globals()`` of the
+    module that loads the data. Functions for promises without ``locals`` are cached
+    using an LRU cache of size ``maxsize``.
+    """
+    def __init__(self, namespace: dict, maxsize=256):
+        self._namespace = namespace
+        self._resolve_cached = functools.lru_cache(maxsize=maxsize)(self._evaluate)
+
+    def _evaluate(self, promise: str):
+        return eval(_compile(promise), self._namespace)
+
+    def resolve(self, promise: str, locals=None):
+        """
+        Returns the function that loads the data for ``promise``.
+        The keyword argument ``locals`` is either None or a dict supplying some locals for the promise.
+        """
+        loader = named_loader(promise)
+        if(loader is not None):
+            return loader
+
+        if(locals is None):
+            return self._resolve_cached(promise)
+
+        ctx = dict(self._namespace)
+        ctx.update(locals)
+        return eval(_compile(promise), ctx)
+
+    def cache_info(self):
+        return self._resolve_cached.cache_info()
+
+    def cache_clear(self):
+        self._resolve_cached.cache_clear()
+
+
+def _load_npy(path, mmap_mode=None):
+    return numpy.load(path + ".npy", mmap_mode=mmap_mode)
+
+# Files written by ``numpy.save(path, data)``.
+register_loader("npy", _load_npy)
@@ -1,4 +1,4 @@
-from lattice_data_db.aly_db.export import export_measurement_collection
+from lattice_data_db.aly_db.export import export_measurement_collection, iter_measurement_collection
 
 import numpy as np
 
@@ -14,3 +14,91 @@ def test_export_measurement_collection_origint(populated_db):
     assert np.allclose(expect_values, values)
 
 
+def test_export_measurement_collection_array(populated_db):
+    expect_values = np.array([[v, v**2 + v] for v in range(1200, 1250, 10)])
+    statements = []
+    populated_db.set_trace_callback(statements.append)
+
+    configurations, values = export_measurement_collection(populated_db, "test_measurement_2", "test_collection")
+
+    assert len(statements) == 2
+    assert values.shape == (5, 2)
+    assert [c._id for c in configurations] == [1, 2, 3, 4, 5]
+    assert [c._relapath for c in configurations] == [f"{i}.config" for i in range(1200, 1250, 10)]
+    assert np.allclose(expect_values, values)
+
+
+def test_iter_measurement_collection(populated_db):
+    pairs = list(iter_measurement_collection(populated_db, "test_measurement_2", "test_collection", fetch_size=2))
+
+    assert [cid for cid, _ in pairs] == [1, 2, 3, 4, 5]
+    assert np.allclose([v for _, v in pairs], [[v, v**2 + v] for v in range(1200, 1250, 10)])
+
+
+def test_iter_measurement_collection_batches(populated_db):
+    batches = list(iter_measurement_collection(populated_db, "test_measurement_2", "test_collection", batch_size=2))
+
+    assert [ids for ids, _ in batches] == [[1, 2], [3, 4], [5]]
+    assert [values.shape for _, values in batches] == [(2, 2), (2, 2), (1, 2)]
+    _, values = export_measurement_collection(populated_db, "test_measurement_2", "test_collection")
+    assert np.allclose(np.concatenate([values for _, values in batches]), values)
+
+
+def test_export_measurement_collection_cache(populated_db):
+    from lattice_data_db.db_backend.db_objecthandles import Measurement, DBValue
+
+    configurations, values = export_measurement_collection(populated_db, "test_measurement_2", "test_collection", cache=True)
+    statements = []
+    populated_db.set_trace_callback(statements.append)
+    configurations2, values2 = export_measurement_collection(populated_db, "test_measurement_2", "test_collection", cache=True)
+    populated_db.set_trace_callback(None)
+
+    # collection id, cache key and basepath; no configurations or values are queried.
+    assert len(statements) == 3
+    assert not any("configurations.ensemble" in statement for statement in statements)
+    assert isinstance(values2, np.memmap)
+    assert [c._id for c in configurations2] == [c._id for c in configurations]
+    assert [c._relapath for c in configurations2] == [c._relapath for c in configurations]
+    assert np.allclose(values2, values)
+
+    # New measurements invalidate the cache.
+    Measurement(6, DBValue(np.array([1, 2])), "test_measurement_2").store(populated_db)
+    configurations3, values3 = export_measurement_collection(populated_db, "test_measurement_2", "test_collection", cache=True)
+    assert not isinstance(values3, np.memmap)
+    assert values3.shape == (6, 2)
+    configurations3, values3 = export_measurement_collection(populated_db, "test_measurement_2", "test_collection", cache=True)
+    assert isinstance(values3, np.memmap)
+    assert values3.shape == (6, 2)
+    assert [c._id for c in configurations3] == [1, 2, 3, 4, 5, 6]
+
+    cache_dir = DBValue.get_basepth(populated_db) / "export_cache"
+    assert sorted(f.suffix for f in cache_dir.iterdir()) == [".json", ".npy"]
+
+
+def test_export_measurement_collection_cache_readonly(populated_db, tmp_path):
+    from lattice_data_db.db_backend.db_objecthandles import DBValue
+    from lattice_data_db.db_backend.connection import open_database
+
+    populated_db.commit()
+    cache_dir = DBValue.get_basepth(populated_db) / "export_cache"
+    ro = open_database(tmp_path / "test.db", mode="ro")
+
+    configurations, values = export_measurement_collection(ro, "test_measurement_2", "test_collection", cache=True)
+    assert values.shape == (5, 2)
+    assert not cache_dir.exists()
+
+    # Caches written by writable connections are used.
+    export_measurement_collection(populated_db, "test_measurement_2", "test_collection", cache=True)
+    configurations2, values2 = export_measurement_collection(ro, "test_measurement_2", "test_collection", cache=True)
+    assert isinstance(values2, np.memmap)
+    assert [c._id for c in configurations2] == [c._id for c in configurations]
+    assert np.allclose(values2, values)
+    ro.close()
+
+
+def test_export_measurement_collection_batch(populated_db):
+    configurations, values = export_measurement_collection(populated_db, "test_measurement_2", "test_collection", output="batch")
+
+    assert list(configurations.ids) == [1, 2, 3, 4, 5]
+    assert list(configurations.relapaths) == [f"{i}.config" for i in range(1200, 1250, 10)]
+    assert values.shape == (5, 2)
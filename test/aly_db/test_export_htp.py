@@ -0,0 +1,73 @@
+from lattice_data_db.aly_db.export_htp import export_measurement_group
+from lattice_data_db.htp_db.datastore import HTPStore, DataLoadError
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="function")
+def populated_store(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    for i in range(5):
+        store.store(f"corr_{i}", np.arange(4.0) * i, group="corr", meta={"cfg": i})
+    store.store("plaq", np.array([0.59]), group="plaq")
+    store.sync_journal()
+    return store
+
+def test_export_measurement_group(populated_store):
+    tags, data, meta = export_measurement_group(populated_store, "corr")
+
+    assert data.shape == (5, 4)
+    for tag, d, m in zip(tags, data, meta):
+        i = int(tag.split("_")[1])
+        assert m["meta"]["cfg"] == i
+        assert np.allclose(d, np.arange(4.0) * i)
+
+def test_export_measurement_group_mmap(populated_store, tmp_path):
+    store = HTPStore.open("test_store", abspath=tmp_path, mmap_mode="r")
+    assert isinstance(store.get_data("corr_1"), np.memmap)
+
+    tags, data, meta = export_measurement_group(store, "corr", out=tmp_path / "corr.npy")
+
+    assert isinstance(data, np.memmap)
+    data.flush()
+    on_disk = np.load(tmp_path / "corr.npy")
+    for tag, d in zip(tags, on_disk):
+        assert np.allclose(d, store.get_data(tag))
+
+def test_export_measurement_group_out_shape(populated_store):
+    with pytest.raises(ValueError):
+        export_measurement_group(populated_store, "corr", out=np.empty((5, 3)))
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_export_measurement_group_parallel(populated_store, executor):
+    tags, data, meta = export_measurement_group(populated_store, "corr", workers=3, executor=executor)
+
+    for tag, d in zip(tags, data):
+        assert np.allclose(d, populated_store.get_data(tag))
+
+def test_export_measurement_group_failures(populated_store):
+    import os
+    os.remove(populated_store._data_path("corr_2") + ".npy")
+
+    with pytest.raises(DataLoadError) as exc_info:
+        export_measurement_group(populated_store, "corr", workers=2)
+
+    assert list(exc_info.value.failures) == ["corr_2"]
+
+def test_export_measurement_group_mixed_dtypes(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    store.store("a", np.arange(3), group="g")
+    store.store("b", np.arange(3) + 0.5, group="g")
+    store.store("c", np.arange(3) + 1j, group="g")
+    store.sync_journal()
+
+    tags, data, meta = export_measurement_group(store, "g")
+    assert data.dtype == np.complex128
+    for tag, d in zip(tags, data):
+        assert np.array_equal(d, store.get_data(tag))
+
+    with pytest.raises(DataLoadError) as exc_info:
+        export_measurement_group(store, "g", out=np.empty((3, 3)))
+    assert list(exc_info.value.failures) == ["c"]
+    assert isinstance(exc_info.value.failures["c"], TypeError)
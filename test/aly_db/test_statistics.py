@@ -0,0 +1,160 @@
+from lattice_data_db.aly_db.statistics import compute_statistics, jackknife_samples, blocked_jackknife_samples, bootstrap_indices, bootstrap_samples, compute_bootstrap, compute_blocked_jackknife
+from lattice_data_db.db_backend.db_objecthandles import Measurement, DBValue, Collection
+
+import numpy as np
+
+
+def test_jackknife_samples():
+    values = np.random.normal(size=(7, 3))
+    expect = np.array([np.delete(values, i, axis=0).mean(axis=0) for i in range(7)])
+
+    assert np.allclose(jackknife_samples(values), expect)
+
+
+def test_compute_statistics(populated_db):
+    values = np.array([[v, v**2 + v] for v in range(1200, 1250, 10)], dtype=float)
+
+    configuration_ids, mean, jackknife = compute_statistics(populated_db, "test_measurement_2", "test_collection")
+
+    assert configuration_ids == [1, 2, 3, 4, 5]
+    assert np.allclose(mean, values.mean(axis=0))
+    assert np.allclose(jackknife, jackknife_samples(values))
+    assert populated_db.execute("SELECT COUNT(*) FROM jackknifes").fetchone()[0] == 5
+    assert populated_db.execute("SELECT COUNT(*) FROM means").fetchone()[0] == 1
+
+
+def test_compute_statistics_cached(populated_db):
+    compute_statistics(populated_db, "test_measurement_2", "test_collection")
+    n_values = populated_db.execute("SELECT COUNT(*) FROM data_values").fetchone()[0]
+
+    statements = []
+    populated_db.set_trace_callback(statements.append)
+    configuration_ids, mean, jackknife = compute_statistics(populated_db, "test_measurement_2", "test_collection")
+    populated_db.set_trace_callback(None)
+
+    assert not any(s.startswith("INSERT") for s in statements)
+    assert configuration_ids == [1, 2, 3, 4, 5]
+    assert jackknife.shape == (5, 2)
+
+    # A new measurement on a configuration in the collection invalidates the results.
+    Measurement(6, DBValue(np.array([1.0, 2.0])), "test_measurement_2").store(populated_db)
+    configuration_ids, mean, jackknife = compute_statistics(populated_db, "test_measurement_2", "test_collection")
+
+    assert configuration_ids == [1, 2, 3, 4, 5, 6]
+    assert jackknife.shape == (6, 2)
+    # The stored results were updated.
+    assert populated_db.execute("SELECT COUNT(*) FROM jackknifes").fetchone()[0] == 6
+    assert populated_db.execute("SELECT COUNT(*) FROM data_values").fetchone()[0] == n_values + 2
+
+
+def test_compute_statistics_incremental(populated_db):
+    compute_statistics(populated_db, "test_measurement_2", "test_collection")
+
+    collection = Collection.findby_name(populated_db, "test_collection")
+    collection.add_configurations(populated_db, [7, 8])
+    new_values = [np.array([1.0, 2.0]), np.array([3.0, 4.0]), np.array([5.0, 6.5])]
+    Measurement.store_many(populated_db, [Measurement(c, DBValue(v), "test_measurement_2") for c, v in zip([6, 7, 8], new_values)])
+
+    statements = []
+    populated_db.set_trace_callback(statements.append)
+    configuration_ids, mean, jackknife = compute_statistics(populated_db, "test_measurement_2", "test_collection")
+    populated_db.set_trace_callback(None)
+
+    # updated incrementally; stored values are not modified.
+    assert not any(s.startswith("DELETE FROM jackknifes") or s.startswith("UPDATE data_values") for s in statements)
+    assert configuration_ids == [1, 2, 3, 4, 5, 6, 7, 8]
+    n_values = populated_db.execute("SELECT COUNT(*) FROM data_values").fetchone()[0]
+    # 13 measurements, 8 jackknife samples, the mean and the sum.
+    assert n_values == 13 + 8 + 2
+
+    values = np.array([[v, v**2 + v] for v in range(1200, 1250, 10)] + new_values)
+    assert np.allclose(mean, values.mean(axis=0))
+    assert np.allclose(jackknife, jackknife_samples(values))
+
+    # The stored results are the updated ones.
+    configuration_ids2, mean2, jackknife2 = compute_statistics(populated_db, "test_measurement_2", "test_collection")
+    assert configuration_ids2 == configuration_ids
+    assert np.allclose(jackknife2, jackknife)
+    _, mean3, jackknife3 = compute_statistics(populated_db, "test_measurement_2", "test_collection", recompute=True)
+    assert np.allclose(mean3, mean)
+    assert np.allclose(jackknife3, jackknife)
+
+
+def test_blocked_jackknife_samples():
+    values = np.random.normal(size=(10, 3))
+
+    assert np.allclose(blocked_jackknife_samples(values, 1), jackknife_samples(values))
+    # The last value is dropped.
+    blocks = values[:9].reshape(3, 3, 3)
+    expect = [np.delete(blocks, i, axis=0).reshape(-1, 3).mean(axis=0) for i in range(3)]
+    assert np.allclose(blocked_jackknife_samples(values, 3), expect)
+
+
+def test_bootstrap_samples():
+    values = np.random.normal(size=(10, 3))
+    indices = bootstrap_indices(10, 20, seed=42)
+
+    assert indices.shape == (20, 10)
+    assert np.all(indices == bootstrap_indices(10, 20, seed=42))
+    assert np.allclose(bootstrap_samples(values, indices), [values[i].mean(axis=0) for i in indices])
+
+
+def test_compute_bootstrap(populated_db):
+    configuration_ids, samples1 = compute_bootstrap(populated_db, "test_measurement_1", "test_collection", 50, seed=1)
+    _, samples2 = compute_bootstrap(populated_db, "test_measurement_2", "test_collection", 50, seed=1)
+
+    assert configuration_ids == [1, 2, 3, 4, 5]
+    assert samples1.shape == (50,)
+    assert samples2.shape == (50, 2)
+    # Both measurements use the same resamples.
+    assert np.allclose(samples2[:, 0], samples1)
+    assert populated_db.execute("SELECT COUNT(*) FROM resample_indices").fetchone()[0] == 1
+
+    statements = []
+    populated_db.set_trace_callback(statements.append)
+    configuration_ids2, samples3 = compute_bootstrap(populated_db, "test_measurement_2", "test_collection", 50, seed=1)
+    populated_db.set_trace_callback(None)
+
+    assert not any(s.startswith("INSERT") for s in statements)
+    assert configuration_ids2 == configuration_ids
+    assert np.allclose(samples3, samples2)
+
+    _, samples4 = compute_bootstrap(populated_db, "test_measurement_2", "test_collection", 50, seed=2)
+    assert not np.allclose(samples4, samples2)
+
+
+def test_compute_blocked_jackknife(populated_db):
+    values = np.array([[v, v**2 + v] for v in range(1200, 1250, 10)], dtype=float)
+
+    configuration_ids, samples = compute_blocked_jackknife(populated_db, "test_measurement_2", "test_collection", 2)
+    assert np.allclose(samples, blocked_jackknife_samples(values, 2))
+
+    Measurement(6, DBValue(np.array([1.0, 2.0])), "test_measurement_2").store(populated_db)
+    configuration_ids, samples = compute_blocked_jackknife(populated_db, "test_measurement_2", "test_collection", 2)
+    values = np.concatenate([values, [[1.0, 2.0]]])
+    assert configuration_ids == [1, 2, 3, 4, 5, 6]
+    assert np.allclose(samples, blocked_jackknife_samples(values, 2))
+    assert populated_db.execute("SELECT COUNT(*) FROM resamples").fetchone()[0] == 1
+
+
+def test_resamples_measurement_order(populated_db):
+    # test_measurement_1 was written in configuration order, this copy in reverse order.
+    Measurement.store_many(populated_db, [Measurement(cid, DBValue(np.array(1200.0 + 10 * (cid - 1))), "reversed")
+                                          for cid in range(5, 0, -1)])
+
+    configuration_ids, samples1 = compute_bootstrap(populated_db, "test_measurement_1", "test_collection", 50, seed=1)
+    configuration_ids2, samples2 = compute_bootstrap(populated_db, "reversed", "test_collection", 50, seed=1)
+    assert configuration_ids2 == configuration_ids == [1, 2, 3, 4, 5]
+    assert np.allclose(samples2, samples1)
+
+    # Cached samples return the configuration ids in the same order.
+    assert compute_bootstrap(populated_db, "reversed", "test_collection", 50, seed=1)[0] == [1, 2, 3, 4, 5]
+
+    _, blocked1 = compute_blocked_jackknife(populated_db, "test_measurement_1", "test_collection", 2)
+    _, blocked2 = compute_blocked_jackknife(populated_db, "reversed", "test_collection", 2)
+    assert np.allclose(blocked2, blocked1)
+
+    # Other configurations use another index matrix.
+    Measurement.store_many(populated_db, [Measurement(cid, DBValue(np.array(1.0 * cid)), "other") for cid in range(2, 7)])
+    compute_bootstrap(populated_db, "other", "test_collection", 50, seed=1)
+    assert populated_db.execute("SELECT COUNT(*) FROM resample_indices").fetchone()[0] == 2
@@ -0,0 +1,72 @@
+from lattice_data_db.db_backend.array_converter import adapt_array, convert_array, is_compact_array, migrate_array_storage
+from lattice_data_db.db_backend.db_objecthandles import DBValue
+from lattice_data_db.db_backend.schema import schema_init
+import sqlite3
+import base64
+import struct
+import io
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("arr", [
+    np.arange(-1, 2, 0.01)
+    , np.array(12)
+    , np.zeros((0, 3))
+    , (np.arange(12) + 1j).reshape(3, 4)
+    , np.arange(12, dtype=">i4").reshape(3, 4)
+    , np.asfortranarray(np.arange(12.0).reshape(3, 4))
+    , np.array(["a", "bc"])
+    ])
+def test_roundtrip(arr):
+    blob = adapt_array(arr)
+    assert is_compact_array(blob)
+
+    arr2 = convert_array(bytes(blob))
+
+    assert arr2.dtype == arr.dtype
+    assert arr2.shape == arr.shape
+    assert arr2.flags.aligned
+    assert np.array_equal(arr, arr2)
+
+def test_roundtrip_structured():
+    arr = np.array([(1, 2.0), (3, 4.0)], dtype=[("a", "<i4"), ("b", "<f8")])
+    arr2 = convert_array(bytes(adapt_array(arr)))
+
+    assert arr2.dtype == arr.dtype
+    assert np.array_equal(arr, arr2)
+
+def legacy_blob(arr):
+    out = io.BytesIO()
+    np.save(out, arr, allow_pickle=False)
+    return base64.b64encode(out.getvalue())
+
+def v1_blob(arr):
+    # compact format version 1: no padding.
+    dtype = arr.dtype.str.encode("ascii")
+    header = struct.pack("<4sBBH", b"LDDA", 1, arr.ndim, len(dtype)) + dtype + struct.pack(f"<{arr.ndim}Q", *arr.shape)
+    return header + arr.tobytes()
+
+def test_legacy_readable():
+    arr = np.arange(10.0)
+    assert np.array_equal(convert_array(legacy_blob(arr)), arr)
+    assert np.array_equal(convert_array(v1_blob(arr.reshape(2, 5))), arr.reshape(2, 5))
+
+def test_migrate_array_storage(tmp_path):
+    conn = sqlite3.connect(tmp_path / "test.db", detect_types=sqlite3.PARSE_DECLTYPES)
+    schema_init(conn)
+    values = [np.arange(i, i + 5.0) for i in range(7)]
+    for v in values[:3]:
+        conn.execute("INSERT INTO data_values(is_inline, av) VALUES(?, ?)", (1, sqlite3.Binary(legacy_blob(v))))
+    conn.execute("INSERT INTO data_values(is_inline, av) VALUES(?, ?)", (1, sqlite3.Binary(v1_blob(values[3]))))
+    for v in values[4:]:
+        DBValue(v).store(conn)
+    conn.commit()
+
+    assert migrate_array_storage(conn, chunk_size=3) == 4
+
+    blobs = [f[0] for f in conn.execute("SELECT CAST(av AS BLOB) FROM data_values ORDER BY rowid")]
+    assert all(is_compact_array(b) for b in blobs)
+    for rid, v in enumerate(values, 1):
+        assert np.array_equal(DBValue.load(conn, rid)._value, v)
@@ -0,0 +1,61 @@
+from lattice_data_db.db_backend.db_objecthandles import Collection, Configuration, Measurement, DBValue, ConfigurationBatch, MeasurementBatch
+from lattice_data_db.db_backend.tasks import find_configurations_for_collection, find_missing_configurations_for_collection, find_measurements_for_collection
+
+import numpy as np
+import pytest
+
+
+def test_handles_have_slots():
+    conf = Configuration(1, "1200.config", "np.load")
+    with pytest.raises(AttributeError):
+        conf.foo = 1
+    assert not hasattr(DBValue(1), "__dict__")
+    assert not hasattr(Measurement(1, DBValue(1), "m"), "__dict__")
+    assert not hasattr(Collection("c", [1]), "__dict__")
+
+
+def test_configuration_batch(small_populated_db):
+    Collection("test", [1, 4, 5]).store(small_populated_db)
+
+    batch = find_configurations_for_collection(small_populated_db, "test", output="batch")
+
+    assert isinstance(batch, ConfigurationBatch)
+    assert len(batch) == 3
+    assert list(batch.ids) == [1, 4, 5]
+    assert list(batch.relapaths) == ["1200.config", "1230.config", "1240.config"]
+    conf = batch[1]
+    assert isinstance(conf, Configuration)
+    assert (conf._id, conf._ensemble, conf._relapath, conf._load_promise) == (4, 1, "1230.config", "np.load")
+    assert list(batch[batch.ids > 1].ids) == [4, 5]
+    assert [c._id for c in batch] == [1, 4, 5]
+
+    assert len(batch[:0]) == 0
+    missing = find_missing_configurations_for_collection(small_populated_db, "test", "test_measurement", output="batch")
+    assert list(missing.ids) == [1, 4, 5]
+
+
+def test_configuration_batch_null_load_promise(small_populated_db):
+    small_populated_db.execute("INSERT INTO configurations VALUES(?, ?, NULL)", (1, "1300.config"))
+    Collection("test", [1, 11]).store(small_populated_db)
+
+    objects = find_configurations_for_collection(small_populated_db, "test")
+    batch = find_configurations_for_collection(small_populated_db, "test", output="batch")
+    assert batch[1]._load_promise is None
+    assert [(c._id, c._relapath, c._load_promise) for c in batch] == [(c._id, c._relapath, c._load_promise) for c in objects]
+
+
+def test_measurement_batch(small_populated_db):
+    Collection("test", [1, 4, 5]).store(small_populated_db)
+    Measurement.store_many(small_populated_db, [Measurement(c, DBValue(np.array([c, 2 * c])), "test_measurement") for c in [5, 4, 6]])
+
+    batch = find_measurements_for_collection(small_populated_db, "test", "test_measurement")
+
+    assert isinstance(batch, MeasurementBatch)
+    assert list(batch.configurations) == [5, 4]
+    assert list(batch.names) == ["test_measurement"] * 2
+    assert list(batch[1:].ids) == [batch.ids[1]]
+    measurement = batch.load(small_populated_db, 1)
+    assert measurement._configuration == 4
+    assert np.allclose(measurement._value._value, [4, 8])
+    with pytest.raises(TypeError):
+        batch[0]
@@ -24,3 +24,13 @@ def test_collection_store_search(small_populated_db):
     assert isinstance(collection2, Collection)
     assert collection._name == collection2._name
     assert collection._configurations == collection2._configurations
+
+
+def test_collection_add_configurations(small_populated_db):
+    collection = Collection("small_test_collection", [1, 2, 3, 4])
+    rid = collection.store(small_populated_db)
+
+    added = collection.add_configurations(small_populated_db, [Configuration.load(small_populated_db, 5), 4, 6])
+
+    assert added == [5, 6]
+    assert Collection.load(small_populated_db, rid)._configurations == [1, 2, 3, 4, 5, 6]
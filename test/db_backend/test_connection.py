@@ -0,0 +1,70 @@
+from lattice_data_db.db_backend.connection import open_database, close_pooled
+from lattice_data_db.db_backend.schema import schema_init
+from lattice_data_db.db_backend.db_objecthandles import DBValue
+
+import os
+import sqlite3
+import threading
+import numpy as np
+import pytest
+
+
+def test_open_database(tmp_path):
+    conn = open_database(tmp_path / "test.db")
+    schema_init(conn)
+
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 30000
+
+    rid = DBValue(np.arange(6).reshape(2, 3)).store(conn)
+    assert np.all(DBValue.load(conn, rid)._value == np.arange(6).reshape(2, 3))
+
+def test_open_database_readonly(tmp_path):
+    conn = open_database(tmp_path / "test.db")
+    schema_init(conn)
+    rid = DBValue(np.array([1.0, 2.0])).store(conn)
+
+    ro = open_database(tmp_path / "test.db", mode="ro")
+    assert np.allclose(DBValue.load(ro, rid)._value, [1.0, 2.0])
+    with pytest.raises(sqlite3.OperationalError):
+        DBValue(np.array([3.0])).store(ro)
+
+    with pytest.raises(sqlite3.OperationalError):
+        open_database(tmp_path / "missing.db", mode="rw")
+
+def test_open_database_pools(tmp_path, monkeypatch):
+    path = tmp_path / "test.db"
+    try:
+        conn = open_database(path, pool="thread")
+        assert open_database(path, pool="thread") is conn
+        assert open_database(path, mode="ro", pool="thread") is not conn
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(open_database(path, pool="thread")))
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+
+        with pytest.raises(ValueError):
+            open_database(path, pool="process")
+
+        thread_conn = conn
+        conn = open_database(path, mode="ro", pool="process")
+        thread = threading.Thread(target=lambda: other.append(open_database(path, mode="ro", pool="process")))
+        thread.start()
+        thread.join()
+        assert other[1] is conn
+
+        # e.g., after fork.
+        pid = os.getpid()
+        monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+        assert open_database(path, mode="ro", pool="process") is not conn
+        assert open_database(path, pool="thread") is not thread_conn
+        close_pooled()
+        monkeypatch.undo()
+    finally:
+        close_pooled()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
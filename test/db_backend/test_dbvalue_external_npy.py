@@ -1,8 +1,10 @@
 from lattice_data_db.db_backend.db_objecthandles import DBValue 
 from lattice_data_db.db_backend.schema import schema_init
+from lattice_data_db.db_backend.connection import open_database
 import sqlite3
 
 import numpy as np
+import pytest
 
 def test_dbvalue_store_load(tmp_path):
     # This test is a bit phony. Usually, one will want to store the values 
@@ -19,3 +21,36 @@ def test_dbvalue_store_load(tmp_path):
     value2 = DBValue.load(conn, rid, locals=locals())
 
     assert np.allclose(value._value.v, value2._value.v)
+
+def test_dbvalue_store_queries(tmp_path):
+    # The context (and the base path) is kept for connections from open_database.
+    conn = open_database(tmp_path / "test.db")
+    schema_init(conn)
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    rids = []
+    for i in range(3):
+        value = DBValue([i, i + 1], store_file=lambda p,o: np.save(p, o), promise_loadfile="lambda fname: list(numpy.load(fname + '.npy'))")
+        rids.append(value.store(conn))
+    conn.set_trace_callback(None)
+
+    # The base path is queried once per connection, no MAX(rowid) scans.
+    assert sum("db_meta" in s for s in statements) <= 1
+    assert not any("MAX(rowid)" in s for s in statements)
+    for i, rid in enumerate(rids):
+        relapath = conn.execute("SELECT relapath FROM data_values WHERE rowid=?", (rid,)).fetchone()[0]
+        assert relapath.startswith(f"{rid}-")
+        assert DBValue.load(conn, rid)._value == [i, i + 1]
+
+def test_dbvalue_store_failure_rolls_back(tmp_path):
+    conn = sqlite3.connect(tmp_path / "test.db", detect_types=sqlite3.PARSE_DECLTYPES)
+    schema_init(conn)
+    def failing_store(p, o):
+        raise IOError("disk full")
+    value = DBValue([1], store_file=failing_store, promise_loadfile="lambda fname: None")
+
+    with pytest.raises(IOError):
+        value.store(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM data_values").fetchone()[0] == 0
@@ -0,0 +1,111 @@
+from lattice_data_db.db_backend.db_objecthandles import Collection, Measurement, DBValue
+from lattice_data_db.db_backend.evaluation import EvaluationRun
+from lattice_data_db.db_backend.tasks import find_missing_configurations_for_collection
+
+import os
+import threading
+import time
+import concurrent.futures
+import numpy as np
+import pytest
+
+
+def measure(configuration):
+    return np.array([configuration._id, len(configuration._relapath)], dtype=float)
+
+def measure_fails_on_5(configuration):
+    if(configuration._id == 5):
+        raise ValueError("bad configuration")
+    return measure(configuration)
+
+def measure_crashes_on_5(configuration):
+    if(configuration._id == 5):
+        os._exit(1)
+    return measure(configuration)
+
+class CountInFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self, configuration):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return measure(configuration)
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_evaluation_run(small_populated_db, executor):
+    Collection("test", [1, 2, 4, 5, 6]).store(small_populated_db)
+    Measurement(4, DBValue(np.array([4.0, 11.0])), "test_measurement").store(small_populated_db)
+
+    evaluation = EvaluationRun(small_populated_db, "test", "test_measurement", measure, workers=2, executor=executor, batch_size=2)
+    assert evaluation.run() == 4
+
+    assert find_missing_configurations_for_collection(small_populated_db, "test", "test_measurement") == []
+    c = small_populated_db.execute("SELECT configuration, value FROM measurements WHERE name = ? ORDER BY configuration", ("test_measurement",))
+    for cid, vid in c.fetchall():
+        assert np.allclose(DBValue.load(small_populated_db, vid)._value, [cid, 11])
+
+    timing = evaluation.timing()
+    assert sorted(cid for cid, _, _ in timing) == [1, 2, 5, 6]
+    assert all(seconds >= 0 and error is None for _, seconds, error in timing)
+    assert small_populated_db.execute("SELECT COUNT(*) FROM evaluation_runs WHERE finished IS NOT NULL").fetchone()[0] == 1
+
+
+def test_evaluation_run_resume(small_populated_db):
+    Collection("test", [1, 2, 4, 5, 6]).store(small_populated_db)
+
+    evaluation = EvaluationRun(small_populated_db, "test", "test_measurement", measure_fails_on_5, executor="thread", batch_size=2)
+    assert evaluation.run() == 4
+    assert list(evaluation.failures) == [5]
+    assert "bad configuration" in evaluation.failures[5]
+
+    # The run is not finished and is resumed.
+    evaluation2 = EvaluationRun(small_populated_db, "test", "test_measurement", measure, executor="thread")
+    assert evaluation2.run() == 1
+    assert evaluation2.run_id == evaluation.run_id
+    assert evaluation2.failures == {}
+
+    timing = evaluation2.timing()
+    assert [cid for cid, _, error in timing if error is not None] == [5]
+    assert sorted(cid for cid, _, error in timing if error is None) == [1, 2, 4, 5, 6]
+    assert small_populated_db.execute("SELECT COUNT(*) FROM evaluation_runs").fetchone()[0] == 1
+
+
+def test_evaluation_run_max_in_flight(small_populated_db):
+    Collection("test", [1, 2, 3, 4, 5, 6]).store(small_populated_db)
+
+    function = CountInFlight()
+    evaluation = EvaluationRun(small_populated_db, "test", "test_measurement", function, workers=4, executor="thread", batch_size=2, max_in_flight=2)
+    assert evaluation.run() == 6
+    assert function.max_in_flight <= 2
+
+
+def test_evaluation_run_failures_per_run(small_populated_db):
+    Collection("test", [1, 2, 5]).store(small_populated_db)
+
+    evaluation = EvaluationRun(small_populated_db, "test", "test_measurement", measure_fails_on_5, executor="thread")
+    assert evaluation.run() == 2
+    assert list(evaluation.failures) == [5]
+    evaluation._function = measure
+    assert evaluation.run() == 1
+    assert evaluation.failures == {}
+
+
+def test_evaluation_run_broken_pool(small_populated_db):
+    Collection("test", [1, 2, 4, 5, 6]).store(small_populated_db)
+
+    evaluation = EvaluationRun(small_populated_db, "test", "test_measurement", measure_crashes_on_5, workers=1, executor="process", max_in_flight=1)
+    with pytest.raises(concurrent.futures.BrokenExecutor):
+        evaluation.run()
+
+    # The tasks completed before the crash are stored.
+    assert evaluation.n_done == 3
+    missing = find_missing_configurations_for_collection(small_populated_db, "test", "test_measurement", output="ids")
+    assert list(missing) == [5, 6]
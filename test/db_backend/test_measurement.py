@@ -1,5 +1,6 @@
 from lattice_data_db.db_backend.db_objecthandles import DBValue, Measurement, Configuration
 import numpy as np
+import pytest
 
 
 def test_measurement_store_load(small_populated_db):
@@ -17,3 +18,51 @@ def test_measurement_store_load(small_populated_db):
 
 
 
+def test_measurement_store_many(small_populated_db):
+    values = [DBValue(np.arange(i, i + 3.0)) for i in range(7)]
+    measures = [Measurement(cid, v, "Correlator") for cid, v in zip(range(1, 8), values)]
+    # One value that is already stored must not be stored again.
+    values[3].store(small_populated_db)
+
+    rids = Measurement.store_many(small_populated_db, measures, chunk_size=3)
+
+    assert rids == [m._id for m in measures]
+    assert len(set(rids)) == len(rids)
+    assert small_populated_db.execute("SELECT COUNT(*) FROM data_values").fetchone()[0] == 7
+    for measure in measures:
+        measure2 = Measurement.load(small_populated_db, measure._id)
+        assert measure2._configuration == measure._configuration
+        assert measure2._value._id == measure._value._id
+        assert np.allclose(measure2._value._value, measure._value._value)
+
+
+def test_measurement_store_many_caller_transaction(small_populated_db):
+    small_populated_db.execute("BEGIN")
+    small_populated_db.execute("INSERT INTO collections VALUES(?)", ("pending",))
+    Measurement.store_many(small_populated_db, [Measurement(1, DBValue(np.arange(3.0)), "Correlator")])
+
+    # The caller's transaction is not committed.
+    assert small_populated_db.in_transaction
+    small_populated_db.rollback()
+    assert small_populated_db.execute("SELECT COUNT(*) FROM collections").fetchone()[0] == 0
+    assert small_populated_db.execute("SELECT COUNT(*) FROM measurements").fetchone()[0] == 0
+
+
+def test_measurement_store_many_rollback(small_populated_db):
+    def failing_store(p, o):
+        raise IOError("disk full")
+    values = [DBValue(np.arange(3.0)), DBValue([1], store_file=failing_store, promise_loadfile="lambda fname: None")]
+    measures = [Measurement(cid, v, "Correlator") for cid, v in zip([1, 2], values)]
+
+    small_populated_db.execute("BEGIN")
+    small_populated_db.execute("INSERT INTO collections VALUES(?)", ("pending",))
+    with pytest.raises(IOError):
+        Measurement.store_many(small_populated_db, measures)
+
+    assert [v._id for v in values] == [None, None]
+    assert [m._id for m in measures] == [None, None]
+    # Only the block is rolled back.
+    assert small_populated_db.in_transaction
+    small_populated_db.commit()
+    assert small_populated_db.execute("SELECT COUNT(*) FROM collections").fetchone()[0] == 1
+    assert small_populated_db.execute("SELECT COUNT(*) FROM data_values").fetchone()[0] == 0
@@ -0,0 +1,36 @@
+from lattice_data_db.db_backend.schema import schema_init, schema_migrate, schema_version, SCHEMA_VERSION
+import sqlite3
+
+
+def index_names(conn):
+    return {f[0] for f in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+
+def test_schema_init_version(tmp_path):
+    conn = sqlite3.connect(tmp_path / "test.db", detect_types=sqlite3.PARSE_DECLTYPES)
+    schema_init(conn)
+
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert "measurements_name_configuration" in index_names(conn)
+    assert "collections_contains_collection_configuration" in index_names(conn)
+
+def test_schema_migrate_unversioned(tmp_path):
+    conn = sqlite3.connect(tmp_path / "test.db", detect_types=sqlite3.PARSE_DECLTYPES)
+    # Schema as created before schema versioning.
+    conn.execute("CREATE TABLE measurements(configuration INT, value INT, name TEXT)")
+    conn.execute("CREATE TABLE collections_contains(collection INT, configuration INT)")
+    conn.execute("CREATE TABLE configurations(ensemble INT, ensemble_relapath TEXT, load_promise TEXT)")
+    conn.execute("CREATE TABLE ensembles(name TEXT, abspath TEXT UNIQUE, description TEXT)")
+    conn.execute("CREATE TABLE collections(name TEXT)")
+    conn.execute("CREATE TABLE means(collection INT, name TEXT, value INT)")
+    conn.execute("CREATE TABLE jackknifes(collection INT, configuration INT, name TEXT, value INT)")
+    conn.commit()
+
+    assert schema_migrate(conn) == 0
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert "measurements_name_configuration" in index_names(conn)
+
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT rowid FROM measurements WHERE name=? AND configuration=?", ("a", 1)).fetchall()
+    assert any("measurements_name_configuration" in f[-1] for f in plan)
+
+    # Migrating twice is a no-op.
+    assert schema_migrate(conn) == SCHEMA_VERSION
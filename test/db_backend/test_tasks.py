@@ -1,5 +1,8 @@
 from lattice_data_db.db_backend.db_objecthandles import Collection, Configuration, Measurement, DBValue
-from lattice_data_db.db_backend.tasks import find_configurations_for_collection, find_missing_configurations_for_collection
+from lattice_data_db.db_backend.tasks import find_configurations_for_collection, find_missing_configurations_for_collection, find_missing_configurations_for_measurements, ConfigurationRecord
+
+import numpy as np
+import pytest
 
 
 def test_find_configurations_for_collection_empty(small_populated_db):
@@ -64,3 +67,38 @@ def test_find_missing_configurations_for_collection_all_done(small_populated_db)
 
     assert len(confs) == len(confs_expect)
     assert all([conf_eq(c1, c2) for c1, c2 in zip(confs_expect, confs)]) 
+
+
+def test_find_configurations_for_collection_output(small_populated_db):
+    Collection("test", [1, 4, 5]).store(small_populated_db)
+    statements = []
+    small_populated_db.set_trace_callback(statements.append)
+
+    ids = find_configurations_for_collection(small_populated_db, "test", output="ids")
+    records = find_configurations_for_collection(small_populated_db, "test", output="records")
+
+    # per call: one query to find the collection, one for the configurations.
+    assert len(statements) == 4
+    assert isinstance(ids, np.ndarray)
+    assert list(ids) == [1, 4, 5]
+    assert records[1] == ConfigurationRecord(4, 1, "1230.config", "np.load")
+
+    with pytest.raises(ValueError):
+        find_configurations_for_collection(small_populated_db, "test", output="dicts")
+    with pytest.raises(ValueError):
+        find_configurations_for_collection(small_populated_db, "missing")
+
+
+def test_find_missing_configurations_for_measurements(small_populated_db):
+    Collection("test", [1, 4, 5]).store(small_populated_db)
+    Measurement(4, DBValue(12), "test_measurement").store(small_populated_db)
+    Measurement(1, DBValue(12), "test_measurement2").store(small_populated_db)
+    Measurement(5, DBValue(12), "test_measurement2").store(small_populated_db)
+
+    missing = find_missing_configurations_for_measurements(small_populated_db, "test", ["test_measurement", "test_measurement2", "other"], output="ids")
+
+    assert {name: list(ids) for name, ids in missing.items()} == {"test_measurement": [1, 5], "test_measurement2": [4], "other": [1, 4, 5]}
+
+    missing = find_missing_configurations_for_measurements(small_populated_db, "test", ["test_measurement"])
+    confs_expect = [Configuration.load(small_populated_db, i) for i in [1, 5]]
+    assert all([conf_eq(c1, c2) for c1, c2 in zip(confs_expect, missing["test_measurement"])])
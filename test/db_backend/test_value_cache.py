@@ -0,0 +1,95 @@
+from lattice_data_db.db_backend.db_objecthandles import DBValue, Measurement
+from lattice_data_db.db_backend.context import DBContext, ValueCache
+from lattice_data_db.db_backend.connection import open_database
+from lattice_data_db.db_backend.schema import schema_init
+
+import gc
+import sqlite3
+import weakref
+import numpy as np
+import pytest
+
+
+def test_value_cache_eviction():
+    cache = ValueCache(max_bytes=100)
+    cache.put("data_values", 1, "a", 40)
+    cache.put("data_values", 2, "b", 40)
+    assert cache.get("data_values", 1) == "a"
+    cache.put("data_values", 3, "c", 40)
+
+    # 2 is the least recently used entry.
+    assert cache.get("data_values", 2) is None
+    assert cache.get("data_values", 1) == "a"
+    assert cache.info() == {"hits": 2, "misses": 1, "evictions": 1, "entries": 2, "nbytes": 80, "max_bytes": 100}
+
+    cache.put("data_values", 4, "too large", 200)
+    assert cache.get("data_values", 4) is None
+    cache.invalidate("data_values", [1, 3])
+    assert cache.nbytes == 0
+
+
+def test_dbvalue_load_cached(small_populated_db, tmp_path):
+    conn = open_database(tmp_path / "test.db")
+    rid = DBValue(np.array([1.0, 2.0, 3.0])).store(conn)
+    mid = Measurement(1, DBValue(np.array([4.0])), "test_measurement").store(conn)
+    cache = DBContext.of(conn).enable_value_cache(max_bytes=1024)
+
+    try:
+        value = DBValue.load(conn, rid)._value
+        statements = []
+        conn.set_trace_callback(statements.append)
+        value2 = DBValue.load(conn, rid)._value
+        Measurement.load(conn, mid)
+        measurement = Measurement.load(conn, mid)
+        conn.set_trace_callback(None)
+
+        # Only the first Measurement.load queries the database.
+        assert len([s for s in statements if not s.startswith("PRAGMA")]) == 2
+        assert value2 is value
+        assert np.allclose(measurement._value._value, [4.0])
+        with pytest.raises(ValueError):
+            value2[0] = 12
+        assert cache.hits == 3
+
+        DBContext.of(conn).invalidate("data_values", [rid])
+        assert DBValue.load(conn, rid)._value is not value
+    finally:
+        DBContext.of(conn).disable_value_cache()
+
+
+def test_value_cache_other_connection(small_populated_db, tmp_path):
+    conn = open_database(tmp_path / "test.db")
+    rid = DBValue(np.array([1.0, 2.0])).store(conn)
+    DBContext.of(conn).enable_value_cache(max_bytes=1024)
+
+    try:
+        assert np.allclose(DBValue.load(conn, rid)._value, [1.0, 2.0])
+        other = sqlite3.connect(tmp_path / "test.db", detect_types=sqlite3.PARSE_DECLTYPES)
+        other.execute("DELETE FROM data_values WHERE rowid = ?", (rid,))
+        other.execute("INSERT INTO data_values(rowid, is_inline, av) VALUES(?, 1, ?)", (rid, np.array([3.0])))
+        other.commit()
+        other.close()
+
+        assert np.allclose(DBValue.load(conn, rid)._value, [3.0])
+    finally:
+        DBContext.of(conn).disable_value_cache()
+
+def test_context_does_not_keep_connection(tmp_path):
+    conn = open_database(tmp_path / "test.db")
+    schema_init(conn)
+    context = DBContext.of(conn)
+    assert DBContext.of(conn) is context
+    assert context.basepath == tmp_path / "test.db.filestorage"
+
+    ref = weakref.ref(conn)
+    del conn
+    # sqlite3.Connection objects reference themselves through their statement cache.
+    gc.collect()
+    assert ref() is None
+
+
+def test_context_plain_connection(small_populated_db):
+    # Not kept, such that the connection is not kept open.
+    assert DBContext.of(small_populated_db) is not DBContext.of(small_populated_db)
+    with pytest.raises(ValueError):
+        DBContext.of(small_populated_db).enable_value_cache()
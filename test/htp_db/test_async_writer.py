@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from lattice_data_db.htp_db.datastore import HTPStore, DataWriteError
+
+
+def test_async_writer(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+
+    with store.async_writer(max_queue=4) as writer:
+        for i in range(20):
+            writer.store(f"test_data{i}", np.array([i, i**2]), group="g", meta={"i": i})
+        writer.flush()
+        assert writer.queue_depth == 0
+        metrics = writer.metrics
+        assert metrics["written"] == 20
+        assert metrics["latency_max"] >= metrics["latency_mean"] > 0
+
+    assert store.sync_journal() == 20
+    for i in range(20):
+        assert np.allclose(store.get_data(f"test_data{i}"), [i, i**2])
+        assert store.meta[f"test_data{i}"]["meta"] == {"i": i}
+
+def test_async_writer_failure(tmp_path):
+    def store_fn(path, data):
+        if(data[0] == 3):
+            raise IOError("disk full")
+        np.save(path, data)
+    store = HTPStore.new("test_store", abspath=tmp_path, store=store_fn)
+
+    writer = store.async_writer()
+    for i in range(5):
+        writer.store(f"test_data{i}", np.array([i]))
+
+    with pytest.raises(DataWriteError) as exc_info:
+        writer.flush()
+    writer.close()
+
+    assert list(exc_info.value.failures) == ["test_data3"]
+    # No journal entry for the failed write.
+    assert store.sync_journal() == 4
+    assert "test_data3" not in store.tags
+
+def test_async_writer_failure_in_block(tmp_path):
+    def store_fn(path, data):
+        raise IOError("disk full")
+    store = HTPStore.new("test_store", abspath=tmp_path, store=store_fn)
+
+    with pytest.warns(UserWarning, match="failed to store 1 tag"):
+        with pytest.raises(KeyError, match="original"):
+            with store.async_writer() as writer:
+                writer.store("test_data", np.array([1]))
+                raise KeyError("original")
@@ -0,0 +1,114 @@
+import os
+import time
+import pytest
+import numpy as np
+
+from lattice_data_db.htp_db.datastore import HTPStore
+
+
+def journal_files(store):
+    return store._journal_files()
+
+def tmp_files(store):
+    tmp_dir = os.path.join(store._full_path, HTPStore.tmp_dir)
+    if(not os.path.exists(tmp_dir)):
+        return []
+    return os.listdir(tmp_dir)
+
+@pytest.mark.parametrize("fsync", ["none", "always"])
+def test_store_fsync(tmp_path, fsync):
+    store = HTPStore.new("test_store", abspath=tmp_path, fsync=fsync)
+    store.store("test_data", np.array([1, 12, 1]), group="g")
+
+    assert len(journal_files(store)) == 1
+    assert tmp_files(store) == []
+    store.sync_journal()
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store2.tags == ["test_data"]
+    assert np.allclose(store2.get_data("test_data"), [1, 12, 1])
+
+def test_store_fsync_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(HTPStore, "fsync_batch_size", 4)
+    store = HTPStore.new("test_store", abspath=tmp_path, fsync="batch")
+    for i in range(3):
+        store.store(f"test_data{i}", np.array([i]), group="g")
+
+    # Not yet committed.
+    assert journal_files(store) == []
+    assert HTPStore.open("test_store", abspath=tmp_path, syncjournal=True).tags == []
+
+    store.store("test_data3", np.array([3]), group="g")
+    # One journal file for the batch.
+    assert len(journal_files(store)) == 1
+
+    store.store("test_data4", np.array([4]), group="g")
+    store.sync_journal()
+    assert journal_files(store) == []
+    # The order of the tags depends on the order of the journal files.
+    assert sorted(store.tags) == [f"test_data{i}" for i in range(5)]
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    assert sorted(store2.groups["g"]) == sorted(store2.tags)
+    assert np.allclose(store2.get_data("test_data4"), [4])
+
+def test_store_failure_leaves_no_journal(tmp_path):
+    def broken_store(path, data):
+        with open(path, "w") as fout:
+            fout.write("partial")
+        raise OSError("disk full")
+
+    store = HTPStore.new("test_store", abspath=tmp_path, store=broken_store)
+    with pytest.raises(OSError):
+        store.store("test_data", np.array([1, 12, 1]))
+
+    assert journal_files(store) == []
+    assert tmp_files(store) == []
+    assert store._data_files() == []
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("fsync", HTPStore.fsync_policies)
+def test_benchmark_fsync_policy(tmp_path, fsync):
+    n_stores = 500
+    data = np.random.normal(size=1024)
+    store = HTPStore.new("test_store", abspath=tmp_path, fsync=fsync)
+
+    start = time.perf_counter()
+    for i in range(n_stores):
+        store.store(f"test_data{i}", data)
+    store.sync_journal()
+    elapsed = time.perf_counter() - start
+
+    assert len(store.tags) == n_stores
+    print(f"fsync={fsync}: {n_stores} stores in {elapsed:.3f}s ({n_stores / elapsed:.0f} stores/s)")
+
+def test_store_fsync_batch_close(tmp_path):
+    with HTPStore.new("test_store", abspath=tmp_path, fsync="batch") as store:
+        store.store("test_data", np.array([1]), group="g")
+        assert journal_files(store) == []
+    assert len(journal_files(store)) == 1
+
+    store = HTPStore.open("test_store", abspath=tmp_path, fsync="batch")
+    store.store("test_data2", np.array([2]), group="g")
+    with pytest.warns(UserWarning, match="1 journal entries of test_store were not flushed"):
+        del store
+
+def test_sync_removes_stale_tmp_files(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    tmp_dir = os.path.join(store._full_path, HTPStore.tmp_dir)
+    # left over by a crashed writer.
+    os.makedirs(os.path.join(tmp_dir, "stale"))
+    with open(os.path.join(tmp_dir, "stale", "data.npy"), "w") as fout:
+        fout.write("partial")
+    with open(os.path.join(tmp_dir, "stale_jrnl"), "w") as fout:
+        fout.write("{")
+    old = time.time() - HTPStore.tmp_max_age - 10
+    os.utime(os.path.join(tmp_dir, "stale"), (old, old))
+    os.utime(os.path.join(tmp_dir, "stale_jrnl"), (old, old))
+    # possibly used by a running writer.
+    os.makedirs(os.path.join(tmp_dir, "fresh"))
+
+    store.store("test_data", np.array([1]))
+    assert store.sync_journal() == 1
+    assert tmp_files(store) == ["fresh"]
@@ -0,0 +1,62 @@
+import os
+import numpy as np
+
+from lattice_data_db.htp_db.datastore import HTPStore
+
+
+def read_info(store):
+    with open(os.path.join(store._full_path, HTPStore.dbinfo_name), "rb") as fin:
+        return fin.read()
+
+def test_sync_appends_index(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    info_before = read_info(store)
+
+    store.store("test_data", np.array([1, 12, 1]), group="g")
+    store.sync_journal()
+    store.store("test_data2", np.array([1, 54, 1]), group="g")
+    store.sync_journal()
+
+    # db.info.json is not rewritten on sync.
+    assert read_info(store) == info_before
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store2.tags == ["test_data", "test_data2"]
+    assert store2.groups == {"g": ["test_data", "test_data2"]}
+    assert np.allclose(store2.get_data("test_data2"), [1, 54, 1])
+
+def test_compact_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(HTPStore, "compact_min_records", 4)
+    store = HTPStore.new("test_store", abspath=tmp_path)
+
+    for i in range(10):
+        store.store(f"test_data{i}", np.array([i]), group="g")
+        store.sync_journal()
+
+    # compaction happened: the index log holds less records than there are tags.
+    assert store._info["info"]["indexgeneration"] > 0
+    assert store._index_records <= max(4, len(store.tags))
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store2.tags == [f"test_data{i}" for i in range(10)]
+    assert store2.groups["g"] == store2.tags
+    index_files = [f for f in os.listdir(store._full_path) if f.startswith(HTPStore.index_prefix)]
+    assert index_files == [os.path.basename(store._index_path())]
+
+def test_truncated_index_record(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    store.store("test_data", np.array([1, 12, 1]))
+    store.sync_journal()
+
+    # Simulate a crash while appending.
+    with open(store._index_path(), "ab") as index:
+        index.write(b'{"op": "add", "entr')
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store2.tags == ["test_data"]
+
+    store2.store("test_data2", np.array([1, 54, 1]))
+    store2.sync_journal()
+
+    store3 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store3.tags == ["test_data", "test_data2"]
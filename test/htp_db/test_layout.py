@@ -0,0 +1,50 @@
+import os
+import glob
+import numpy as np
+
+from lattice_data_db.htp_db.datastore import HTPStore
+
+
+def test_sharded_store_load(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path, layout="sharded")
+    store.store("test_data", np.array([1, 12, 1]), group="g")
+    store.store("test_data2", np.array([1, 54, 1]), group="g")
+
+    assert store.synced_journal is False
+    assert len(glob.glob(os.path.join(store._full_path, HTPStore.jrnl_dir, "*", HTPStore.jrnl_prefix + "*"))) == 2
+    assert store.sync_journal() == 2
+    assert store.synced_journal is True
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store2.layout == "sharded"
+    file_name = store2.meta["test_data"]["file"]
+    assert file_name.startswith(HTPStore.data_dir + "/")
+    assert os.path.exists(os.path.join(store2._full_path, file_name) + ".npy")
+    assert np.allclose(store2.get_data("test_data"), [1, 12, 1])
+    assert np.allclose(store2.get_data("test_data2"), [1, 54, 1])
+
+def test_convert_layout(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    names = ["a", "a.b", "test data:1"]
+    for i, name in enumerate(names):
+        store.store(name, np.array([i]))
+    store.sync_journal()
+
+    store.convert_layout("sharded")
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store2.layout == "sharded"
+    for i, name in enumerate(names):
+        assert store2.meta[name]["file"].startswith(HTPStore.data_dir + "/")
+        assert np.allclose(store2.get_data(name), [i])
+    assert not any(f.endswith(".npy") for f in os.listdir(store2._full_path))
+
+    store2.store("b", np.array([3]))
+    store2.sync_journal()
+    store2.convert_layout("flat")
+
+    store3 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store3.layout == "flat"
+    for i, name in enumerate(names + ["b"]):
+        assert np.allclose(store3.get_data(name), [i])
+    assert os.path.exists(os.path.join(store3._full_path, "a.b.npy"))
@@ -0,0 +1,92 @@
+import multiprocessing
+import pytest
+import numpy as np
+
+from lattice_data_db.htp_db import datastore
+from lattice_data_db.htp_db.datastore import HTPStore
+
+
+def test_refresh(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    reader = HTPStore.open("test_store", abspath=tmp_path)
+    assert reader.refresh() is False
+
+    store.store("test_data", np.array([1, 12, 1]), group="g")
+    store.sync_journal()
+    assert reader.refresh() is True
+    assert reader.tags == ["test_data"]
+    assert reader.refresh() is False
+
+    # db.info.json is replaced.
+    store.compact_index()
+    store.store("test_data2", np.array([1, 54, 1]), group="g")
+    store.sync_journal()
+    assert reader.refresh() is True
+    assert reader.groups == {"g": ["test_data", "test_data2"]}
+    assert np.allclose(reader.get_data("test_data2"), [1, 54, 1])
+
+def test_sync_sees_other_sync(tmp_path):
+    store1 = HTPStore.new("test_store", abspath=tmp_path)
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+
+    store1.store("test_data", np.array([1]))
+    store2.sync_journal()
+    store2.store("test_data2", np.array([2]))
+    # store1 has not seen test_data being synced.
+    store1.sync_journal()
+
+    assert store1.tags == ["test_data", "test_data2"]
+    store3 = HTPStore.open("test_store", abspath=tmp_path)
+    assert store3.tags == ["test_data", "test_data2"]
+    assert store3._index_records == 4
+
+
+def store_and_sync(abspath, worker, n_stores):
+    HTPStore.compact_min_records = 8
+    store = HTPStore.open("test_store", abspath=abspath)
+    for i in range(n_stores):
+        store.store(f"test_data_{worker}_{i}", np.array([worker, i]), group="g")
+        store.sync_journal()
+
+@pytest.mark.skipif(datastore.fcntl is None, reason="requires fcntl")
+def test_concurrent_sync(tmp_path):
+    HTPStore.new("test_store", abspath=tmp_path)
+    n_workers, n_stores = 4, 25
+
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=store_and_sync, args=(tmp_path, w, n_stores)) for w in range(n_workers)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+        assert w.exitcode == 0
+
+    store = HTPStore.open("test_store", abspath=tmp_path, syncjournal=True)
+    expect = {f"test_data_{w}_{i}" for w in range(n_workers) for i in range(n_stores)}
+    assert len(store.tags) == len(expect)
+    assert set(store.tags) == expect
+    assert set(store.groups["g"]) == expect
+    assert np.allclose(store.get_data("test_data_3_7"), [3, 7])
+
+def test_readonly_does_not_write(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    store.store("test_data", np.array([1, 12, 1]), group="g")
+    store.sync_journal()
+    store.store("test_data2", np.array([1, 54, 1]), group="g")
+
+    full_path = tmp_path / "test_store"
+    def snapshot():
+        return {str(p.relative_to(full_path)): p.read_bytes() for p in full_path.rglob("*") if p.is_file()}
+    before = snapshot()
+
+    reader = HTPStore.open("test_store", abspath=tmp_path, readonly=True, syncjournal=True)
+    assert reader.sync_journal() == 0
+    assert reader.synced_journal is False
+    with pytest.raises(Exception, match="read only"):
+        reader.compact_index()
+    assert snapshot() == before
+
+    # The reader sees the changes once a writer synced the journal.
+    store.sync_journal()
+    assert reader.sync_journal() == 0
+    assert reader.tags == ["test_data", "test_data2"]
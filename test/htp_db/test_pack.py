@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pytest
+
+from lattice_data_db.htp_db.datastore import HTPStore
+
+
+@pytest.mark.parametrize("layout", ["flat", "sharded"])
+def test_pack_group(tmp_path, layout):
+    store = HTPStore.new("test_store", abspath=tmp_path, layout=layout)
+    values = {f"corr_{i}": np.arange(i, i + 5.0) for i in range(6)}
+    values["complex"] = np.arange(4).reshape(2, 2) + 1j
+    values["empty"] = np.zeros((0, 2))
+    for tag, value in values.items():
+        store.store(tag, value, group="corr")
+    store.store("plaq", np.array([0.59]), group="plaq")
+    store.sync_journal()
+
+    assert store.pack_group("corr", max_segment_bytes=100) == len(values)
+    assert store.pack_group("corr") == 0
+
+    for tag, value in values.items():
+        assert not os.path.exists(store._data_path(tag) + ".npy")
+        data = store.get_data(tag)
+        assert data.dtype == value.dtype
+        assert np.array_equal(data, value)
+    assert len(os.listdir(os.path.join(store._full_path, HTPStore.segment_dir))) > 1
+
+    # new writes still go through the journal.
+    store.store("corr_new", np.arange(5.0), group="corr")
+    store.sync_journal()
+
+    store2 = HTPStore.open("test_store", abspath=tmp_path)
+    for tag, value in values.items():
+        assert np.array_equal(store2.get_data(tag), value)
+    assert np.allclose(store2.get_data("corr_new"), np.arange(5.0))
+    assert np.allclose(store2.get_data("plaq"), [0.59])
+
+    tags = list(values)
+    data, failures = store2.get_data_many(tags, workers=2)
+    assert failures == {}
+    for tag, d in zip(tags, data):
+        assert np.array_equal(d, values[tag])
+    store2.close()
+
+def test_pack_group_synced(tmp_path, monkeypatch):
+    from lattice_data_db.htp_db import datastore
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    for i in range(3):
+        store.store(f"corr_{i}", np.arange(i, i + 5.0), group="corr")
+    store.sync_journal()
+
+    events = []
+    monkeypatch.setattr(datastore, "_fsync_file", lambda path: events.append(("fsync", os.path.dirname(path))))
+    monkeypatch.setattr(datastore, "_fsync_dir", lambda path: events.append(("fsync", path)))
+    real_fsync, real_remove = os.fsync, os.remove
+    monkeypatch.setattr(os, "fsync", lambda fd: events.append(("fsync", "index")) or real_fsync(fd))
+    monkeypatch.setattr(os, "remove", lambda path: events.append(("remove", path)) or real_remove(path))
+
+    # The default fsync policy is "none".
+    assert store.pack_group("corr") == 3
+    first_remove = [kind for kind, _ in events].index("remove")
+    synced = [path for kind, path in events[:first_remove]]
+    assert os.path.join(store._full_path, HTPStore.tmp_dir) in synced
+    assert os.path.join(store._full_path, HTPStore.segment_dir) in synced
+    assert "index" in synced
@@ -4,6 +4,7 @@ import numpy as np
 import glob
 import json
 import time
+import warnings
 
 from lattice_data_db.htp_db.datastore import HTPStore
 
@@ -80,3 +81,59 @@ def test_store_jrnl_collision(tmp_path):
     assert exc_info.value.args[0].startswith("journal entry collision: test_data")
 
 
+
+def test_synced_journal_cached(tmp_path, monkeypatch):
+    new_store = HTPStore.new("test_store", abspath=tmp_path)
+    new_store.store("test_data", np.array([1, 12, 1]))
+    new_store.sync_journal()
+
+    from lattice_data_db.htp_db import datastore
+    globs = []
+    real_glob = datastore.glob.glob
+    monkeypatch.setattr(datastore.glob, "glob", lambda *args, **kwargs: globs.append(args) or real_glob(*args, **kwargs))
+
+    for i in range(10):
+        assert new_store.synced_journal is True
+        new_store.tags
+        new_store.meta
+    assert len(globs) == 0
+
+    # A store from another process is detected.
+    other_store = HTPStore.open("test_store", abspath=tmp_path)
+    other_store.store("test_data2", np.array([1, 12, 1]))
+
+    with pytest.warns(UserWarning, match="journal is not synced"):
+        new_store.tags
+    assert new_store.synced_journal is False
+    assert len(globs) == 1
+
+    new_store.sync_journal()
+    assert new_store.synced_journal is True
+
+def test_synced_journal_other_sync(tmp_path):
+    writer = HTPStore.new("test_store", abspath=tmp_path)
+    reader = HTPStore.open("test_store", abspath=tmp_path)
+    writer.store("test_data", np.array([1, 12, 1]))
+    assert reader.synced_journal is False
+
+    writer.sync_journal()
+    reader.refresh()
+    assert reader.synced_journal is True
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert reader.tags == ["test_data"]
+
+def test_journal_counter_fixed_size(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    counter_path = os.path.join(store._full_path, HTPStore.jrnl_counter_name)
+    # as written by older versions.
+    with open(counter_path, "wb") as counter:
+        counter.write(b"\n" * 3)
+    assert store._journal_counter() == 3
+
+    for i in range(20):
+        store.store(f"test_data{i}", np.array([i]))
+        store.sync_journal()
+    assert os.path.getsize(counter_path) == 8
+    assert store._journal_counter() == 43
+    assert store.synced_journal is True
@@ -25,3 +25,19 @@ def test_store_load_different(tmp_path):
     assert store.synced_journal is True
     assert np.allclose(store.get_data("test_data"), data)
     assert np.allclose(store.get_data("test_data2"), data2)
+
+def test_get_data_many(tmp_path):
+    store = HTPStore.new("test_store", abspath=tmp_path)
+    tags = [f"test_data{i}" for i in range(20)]
+    for i, tag in enumerate(tags):
+        store.store(tag, np.array([i, i**2]))
+    store.sync_journal()
+    os.remove(store._data_path("test_data7") + ".npy")
+
+    data, failures = store.get_data_many(tags + ["missing"], workers=4, max_in_flight=3)
+
+    assert set(failures) == {"test_data7", "missing"}
+    assert data[7] is None and data[-1] is None
+    for i, d in enumerate(data[:-1]):
+        if(i != 7):
+            assert np.allclose(d, [i, i**2])
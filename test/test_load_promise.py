@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from lattice_data_db.load_promise import LoadPromiseResolver, register_loader, unregister_loader
+from lattice_data_db.db_backend import db_objecthandles
+
+
+def test_resolve_cached():
+    resolver = LoadPromiseResolver({"numpy": np})
+    f1 = resolver.resolve("lambda s: numpy.load(s + '.npy')")
+    f2 = resolver.resolve("lambda s: numpy.load(s + '.npy')")
+
+    assert f1 is f2
+    assert resolver.cache_info().hits == 1
+
+def test_resolve_locals_namespace_untouched():
+    namespace = {"numpy": np}
+    resolver = LoadPromiseResolver(namespace)
+
+    f = resolver.resolve("lambda s: scale * numpy.ones(s)", locals={"scale": 3})
+
+    assert np.allclose(f(2), [3, 3])
+    assert "scale" not in namespace
+
+def test_dbvalue_load_locals_globals_untouched(tmp_path):
+    from lattice_data_db.db_backend.db_objecthandles import DBValue
+    from lattice_data_db.db_backend.schema import schema_init
+    import sqlite3
+
+    conn = sqlite3.connect(tmp_path / "test.db", detect_types=sqlite3.PARSE_DECLTYPES)
+    schema_init(conn)
+    scale = 2
+    value = DBValue([1.0, 2.0], store_file=lambda p, o: np.save(p, o), promise_loadfile="lambda fname: scale * numpy.load(fname + '.npy')")
+    rid = value.store(conn)
+
+    value2 = DBValue.load(conn, rid, locals={"scale": scale})
+
+    assert np.allclose(value2._value, [2.0, 4.0])
+    assert "scale" not in vars(db_objecthandles)
+
+def test_named_loader(tmp_path):
+    resolver = LoadPromiseResolver({})
+    register_loader("test_txt", lambda path, dtype="float": np.loadtxt(path, dtype=dtype))
+    try:
+        np.savetxt(tmp_path / "data.txt", [1, 2, 3])
+
+        assert np.allclose(resolver.resolve("test_txt")(tmp_path / "data.txt"), [1, 2, 3])
+        assert resolver.resolve("test_txt:float32")(tmp_path / "data.txt").dtype == np.float32
+    finally:
+        unregister_loader("test_txt")
+
+def test_named_loader_npy_mmap(tmp_path):
+    resolver = LoadPromiseResolver({})
+    np.save(tmp_path / "data", np.arange(5))
+
+    data = resolver.resolve("npy:r")(str(tmp_path / "data"))
+
+    assert isinstance(data, np.memmap)
+    assert np.allclose(data, np.arange(5))
+
+def test_register_loader_invalid_name():
+    with pytest.raises(ValueError):
+        register_loader("a:b", lambda path: None)